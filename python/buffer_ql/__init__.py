@@ -1,7 +1,28 @@
+from .core.reader import (
+    create_reader,
+    link_readers,
+    ReaderPool,
+    container_stats,
+    ALL_KEYS,
+    ALL_VALUES,
+)
+
 from .core.writer import create_encoder
 
+from .core.stream import iter_json_array, iter_ndjson, encode_chunks, encode_stream
+
+from .core.scan import scan, store_items
+
+from .core.inspection import inspect_container, format_report
+
 from .schema.index import extend_schema
 
+from .schema.validate import validate_data
+
+from .schema.base import aligned_bytes
+
+from .helpers.io import Data_Tape
+
 from .helpers.bitmask import (
     encode_bitmask,
     decode_bitmask,
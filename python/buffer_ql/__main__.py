@@ -0,0 +1,43 @@
+import argparse
+import importlib
+import importlib.util
+import sys
+
+from .core.inspection import inspect_container, format_report
+
+
+def load_schema(spec):
+    """Schema from module[:attribute] or path/to/file.py[:attribute], the
+    attribute defaults to schema"""
+    source, _, attribute = spec.partition(":")
+    if source.endswith(".py"):
+        module_spec = importlib.util.spec_from_file_location("_inspected_schema", source)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(source)
+    return getattr(module, attribute or "schema")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m buffer_ql")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    inspect = commands.add_parser(
+        "inspect", help="size breakdown of a container per schema path")
+    inspect.add_argument("container", help="path to the encoded container")
+    inspect.add_argument(
+        "schema", help="module[:attribute] or file.py[:attribute] holding the schema")
+    inspect.add_argument("--root", default="#", help="root type of the container")
+
+    args = parser.parse_args(argv)
+    schema = load_schema(args.schema)
+    with open(args.container, "rb") as f:
+        data = f.read()
+    report = inspect_container(data, schema, args.root)
+    print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
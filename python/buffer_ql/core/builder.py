@@ -0,0 +1,275 @@
+import struct
+from array import array
+
+from ..schema.base import Unflattened
+from ..schema.binding import field_columns
+
+# struct formats that are also array typecodes of the same width
+TYPECODES = "bBhHiIqQfd"
+
+
+class Column:
+    """Values appended under one type, decomposed on the spot into the
+    columns of its children. Primitive values go to typed arrays (or onto
+    the data tape for strings), structure is kept as running offsets and
+    discriminators, so no appended record is held on to."""
+
+    def __init__(self, schema, type_name, db, keep_values=False):
+        record = schema[type_name]
+        self.schema = schema
+        self.type_name = type_name
+        self.record = record
+        self.kind = record["type"]
+        self.db = db
+        self.count = 0
+        self.tape_offsets = None
+        self.packed = bool(record.get("packed"))
+        self.float32 = None
+
+        kind = self.kind
+        if kind in ("Ref", "Link"):
+            raise TypeError(f"{kind} type {type_name} cannot be appended to a builder")
+
+        if kind == "Primitive":
+            fmt = record.get("format")
+            size = record["size"]
+            self.components = 1
+            if (
+                record.get("encode_column")
+                and fmt is not None and fmt in TYPECODES
+                and array(fmt).itemsize == struct.calcsize("<" + fmt)
+            ):
+                self.values = array(fmt)
+                self.components = size // self.values.itemsize
+                if fmt == "f":
+                    # array("f") turns out of range floats into inf, they
+                    # are packed once to raise like encode does
+                    self.float32 = struct.Struct(f"<{self.components}f")
+            elif record.get("serialize") and not record.get("indexed") and not keep_values:
+                self.values = None
+                self.tape_offsets = array('q')
+            else:
+                self.values = []
+        elif self.packed:
+            self.rows = []
+        elif kind in ("Tuple", "NamedTuple"):
+            self.children = [Column(schema, child, db) for child in record["children"]]
+        elif kind in ("Array", "Map"):
+            self.offsets = array('q', [0])
+            self.child = Column(schema, record["children"][0], db)
+            if kind == "Map":
+                self.keys = Column(schema, "String", db,
+                                   keep_values=record.get("key_index") == "hash")
+        elif kind == "Optional":
+            self.bits = bytearray()
+            self.present = array('q', [0])
+            self.child = Column(schema, record["children"][0], db)
+        elif kind == "OneOf":
+            children = record["children"]
+            self.checkers = [schema[child].get("check", lambda v: True)
+                             for child in children]
+            self.discriminator = bytearray()
+            self.prefix = [array('q', [0]) for _ in children]
+            self.children = [Column(schema, child, db) for child in children]
+
+    def append(self, value):
+        kind = self.kind
+        record = self.record
+
+        if kind == "Primitive":
+            if self.tape_offsets is not None:
+                self.tape_offsets.extend(
+                    self.db.put_column((value,), record["serialize"]))
+            elif self.components > 1:
+                if len(value) != self.components:
+                    raise ValueError(
+                        f'{self.type_name} expects {self.components} components, got {len(value)}')
+                if self.float32 is not None:
+                    self.float32.pack(*value)
+                self.values.extend(value)
+            else:
+                if self.float32 is not None:
+                    self.float32.pack(value)
+                self.values.append(value)
+            self.count += 1
+            return
+
+        transform = record.get("transform")
+        if transform:
+            value = transform(value)
+
+        if self.packed:
+            self.rows.append(tuple(field for (field,) in field_columns(record, [value])))
+        elif kind == "Tuple":
+            for i, child in enumerate(self.children):
+                child.append(value[i])
+        elif kind == "NamedTuple":
+            for child, (field,) in zip(self.children, field_columns(record, [value])):
+                child.append(field)
+        elif kind == "Array":
+            child = self.child
+            if (
+                isinstance(value, Unflattened)
+                and isinstance(getattr(child, "values", None), array)
+                and child.components == value.size
+                and len(value.data) == len(value) * value.size
+            ):
+                if child.float32 is not None:
+                    struct.pack(f"<{len(value.data)}f", *value.data)
+                child.values.extend(value.data)
+                child.count += len(value)
+            else:
+                # indexed rather than iterated, slices of an Unflattened
+                # buffer never run out
+                for i in range(len(value)):
+                    child.append(value[i])
+            self.offsets.append(child.count)
+        elif kind == "Map":
+            items = value.items()
+            if record.get("key_index") == "sorted":
+                items = sorted(items, key=lambda item: item[0])
+            for key, item in items:
+                self.keys.append(key)
+                self.child.append(item)
+            self.offsets.append(self.child.count)
+        elif kind == "Optional":
+            if value is None:
+                self.bits.append(0)
+            else:
+                self.bits.append(1)
+                self.child.append(value)
+            self.present.append(self.child.count)
+        elif kind == "OneOf":
+            k = next((k for k, checker in enumerate(self.checkers) if checker(value)), None)
+            if k is None:
+                raise ValueError(
+                    f'Value {value} does not match any of the OneOf types')
+            self.children[k].append(value)
+            self.discriminator.append(k)
+            for prefix, child in zip(self.prefix, self.children):
+                prefix.append(child.count)
+        self.count += 1
+
+    def truncate(self, count):
+        # drops whatever a failed append left behind, strings already put
+        # on the tape stay there unreferenced
+        kind = self.kind
+        if kind == "Primitive":
+            if self.tape_offsets is not None:
+                del self.tape_offsets[count:]
+            else:
+                del self.values[count * self.components:]
+        elif self.packed:
+            del self.rows[count:]
+        elif kind in ("Tuple", "NamedTuple"):
+            for child in self.children:
+                child.truncate(count)
+        elif kind in ("Array", "Map"):
+            del self.offsets[count + 1:]
+            self.child.truncate(self.offsets[count])
+            if kind == "Map":
+                self.keys.truncate(self.offsets[count])
+        elif kind == "Optional":
+            del self.bits[count:]
+            del self.present[count + 1:]
+            self.child.truncate(self.present[count])
+        elif kind == "OneOf":
+            del self.discriminator[count:]
+            for prefix, child in zip(self.prefix, self.children):
+                del prefix[count + 1:]
+                child.truncate(prefix[count])
+        self.count = count
+
+    def source(self, start, end):
+        """Primitive values of rows start to end, as the writer consumes them"""
+        if self.tape_offsets is not None:
+            return self.tape_offsets[start:end]
+        components = self.components
+        values = self.values[start * components: end * components]
+        return Unflattened(values, components) if components > 1 else values
+
+    def packed_rows(self, start, end):
+        keys = self.record["keys"]
+        return [dict(zip(keys, row)) for row in self.rows[start:end]]
+
+
+class Builder:
+    """Container assembled from records appended over a time window
+
+    append(path, record) adds an element to the Array at path (a sequence
+    of NamedTuple keys and Tuple indexes from the root, or a dotted
+    string), set(path, value) gives any other field of the root its value.
+    finish() only assigns offsets and copies the columns into a container,
+    the builder cannot be used afterwards.
+    """
+
+    def __init__(self, schema, root_type, db, assemble, validate=None):
+        self.schema = schema
+        self.root_type = root_type
+        self.db = db
+        self.arrays = {}
+        self.values = {}
+        self.finished = False
+        self._assemble = assemble
+        self._validate = validate
+
+    def append(self, path, record):
+        path, type_name = self._resolve(path)
+        column = self.arrays.get(path)
+        if column is None:
+            if self.schema[type_name]["type"] != "Array":
+                raise TypeError(
+                    f"Records can only be appended to an Array, {type_name} is not")
+            self._claim(path)
+            column = self.arrays[path] = Column(
+                self.schema, self.schema[type_name]["children"][0], self.db)
+        if self._validate is not None:
+            self._validate(self.schema, record, column.type_name)
+        count = column.count
+        try:
+            column.append(record)
+        except Exception:
+            column.truncate(count)
+            raise
+
+    def extend(self, path, records):
+        for record in records:
+            self.append(path, record)
+
+    def set(self, path, value):
+        path, _ = self._resolve(path)
+        if path not in self.values:
+            self._claim(path)
+        self.values[path] = value
+
+    def finish(self):
+        if self.finished:
+            raise ValueError("Builder already finished")
+        self.finished = True
+        return self._assemble(self)
+
+    def _resolve(self, path):
+        if self.finished:
+            raise ValueError("Builder already finished")
+        if isinstance(path, str):
+            path = path.split(".") if path else []
+        steps = []
+        type_name = self.root_type
+        for key in path:
+            record = self.schema[type_name]
+            if record["type"] == "NamedTuple" and key in record["indexes"]:
+                type_name = record["children"][record["indexes"][key]]
+            elif record["type"] == "Tuple" and str(key).isdigit() \
+                    and int(key) < len(record["children"]):
+                key = int(key)
+                type_name = record["children"][key]
+            else:
+                raise KeyError(f"{type_name} has no field {key}")
+            steps.append(key)
+        return tuple(steps), type_name
+
+    def _claim(self, path):
+        for other in (*self.arrays, *self.values):
+            if other[:len(path)] == path or path[:len(other)] == other:
+                raise ValueError(
+                    f'Path {".".join(map(str, path))} overlaps {".".join(map(str, other))}')
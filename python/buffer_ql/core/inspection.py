@@ -0,0 +1,264 @@
+import struct
+from types import SimpleNamespace
+
+from .reader import create_reader
+from ..helpers.bitmask import (
+    decode_bitmask,
+    decode_one_of,
+    index_to_bit,
+    index_to_one_of
+)
+from ..helpers.bitmask_alt import LAYOUTS, decode_discriminator, encode_discriminator
+from ..helpers.io import read_varint, size_varint, FIXED_WIDTH
+
+INT_TYPES = [
+    ("Uint8", 0, 1 << 8, 1),
+    ("Int8", -(1 << 7), 1 << 7, 1),
+    ("Uint16", 0, 1 << 16, 2),
+    ("Int16", -(1 << 15), 1 << 15, 2),
+    ("Uint32", 0, 1 << 32, 4),
+    ("Int32", -(1 << 31), 1 << 31, 4),
+]
+# primitive formats whose values are read back for layout suggestions
+SUGGESTED_FORMATS = ("b", "B", "h", "H", "i", "I", "d")
+
+
+def inspect_container(data, schema, root_type="#"):
+    """Size breakdown of a container per schema path
+
+    The slots of the container are walked from the root. Every column is
+    charged the index and length slots and the payload it takes in the
+    index region, plus the tape entries it points at (strings, bitmasks,
+    key tables, compressed blocks, sections), each one counted once for
+    the first column reaching it. Gaps ahead of a column in the index
+    region are its alignment padding.
+    """
+    Reader = create_reader(data, schema)
+    data_view = Reader.data_view
+    n, m = Reader.index_size, Reader.length_size
+    read_index, read_length = Reader.read_index, Reader.read_length
+    header = data_view[0]
+
+    report = SimpleNamespace(paths={}, size=len(data), header=(n, m),
+                             fixed_width=bool(header & FIXED_WIDTH))
+    segments = []
+    columns = {}
+    entries = set()
+
+    def tape_entry(entry, offset):
+        # bytes of the tape entry at offset, once per container
+        if offset < 0 or offset in entries:
+            return
+        entries.add(offset)
+        length = read_varint(data_view, offset)
+        entry.tape += size_varint(length) + length
+
+    visited = set()
+    stack = [(root_type, 1, 1)]
+    while stack:
+        label, offset, count = stack.pop()
+        if offset < 0 or count == 0 or (label, offset) in visited:
+            continue
+        # shared subtrees are only walked once
+        visited.add((label, offset))
+        record = schema[label]
+        kind = record["type"]
+        entry = report.paths.get(label)
+        if entry is None:
+            entry = report.paths[label] = SimpleNamespace(
+                kind=kind, values=0, index_slots=0, length_slots=0, payload=0,
+                padding=0, tape=0, pointers=[], discriminators=[], samples=[])
+        entry.values += count
+        columns.setdefault(offset, entry)
+        size = 0
+
+        if kind == "Primitive" and record.get("compression"):
+            tape_entry(entry, offset)
+        elif kind == "Primitive" and callable(record["size"]):
+            size = count * n
+            entry.index_slots += count
+            for i in range(count):
+                # tape pointers stay varints in fixed width containers
+                pointer = read_varint(data_view, offset + i * n, True)
+                entry.pointers.append(pointer)
+                tape_entry(entry, pointer)
+        elif kind == "Primitive" or record.get("packed"):
+            size = count * record["size"]
+            entry.payload += size
+        elif kind in ("Tuple", "NamedTuple"):
+            children = record["children"]
+            size = len(children) * n
+            entry.index_slots += len(children)
+            for i, child in enumerate(children):
+                stack.append((child, read_index(data_view, offset + i * n), count))
+        elif kind in ("Array", "Ref"):
+            size = count * (n + m)
+            entry.index_slots += count
+            entry.length_slots += count
+            if kind == "Array":
+                child = record["children"][0]
+                for i in range(count):
+                    slot = offset + i * (n + m)
+                    stack.append((child, read_index(data_view, slot),
+                                  read_length(data_view, slot + n)))
+        elif kind == "Map":
+            hashed = record.get("key_index") == "hash"
+            stride = 2 * n + m + (n if hashed else 0)
+            size = count * stride
+            entry.index_slots += count * (3 if hashed else 2)
+            entry.length_slots += count
+            child = record["children"][0]
+            for i in range(count):
+                slot = offset + i * stride
+                length = read_length(data_view, slot + 2 * n)
+                if hashed:
+                    tape_entry(entry, read_varint(data_view, slot + 2 * n + m, True))
+                stack.append((child, read_index(data_view, slot + n), length))
+                stack.append(("String", read_index(data_view, slot), length))
+        elif kind == "Link":
+            size = 8 * count
+            entry.payload += size
+        elif kind in ("Optional", "OneOf"):
+            pointer = read_varint(data_view, offset, True)
+            tape_entry(entry, pointer)
+            length = read_varint(data_view, pointer)
+            encoded = data_view[pointer + size_varint(length): pointer + size_varint(length) + length]
+            children = record["children"]
+            layout = record.get("bitmask")
+            if kind == "Optional":
+                bitmask = decode_discriminator(encoded, count, 2, True) if layout \
+                    else decode_bitmask(encoded, count)
+                discriminator = list(index_to_bit(bitmask))[:count]
+            else:
+                bitmask = decode_discriminator(encoded, count, len(children)) if layout \
+                    else decode_one_of(encoded, count, len(children))
+                discriminator = list(index_to_one_of(bitmask, len(children)))[:count]
+            entry.discriminators.append(discriminator)
+            size = (len(children) + 1) * n if kind == "OneOf" else 2 * n
+            entry.index_slots += size // n
+            if kind == "Optional":
+                stack.append((children[0], read_index(data_view, offset + n),
+                              sum(discriminator)))
+            else:
+                for k, child in enumerate(children):
+                    stack.append((child, read_index(data_view, offset + (k + 1) * n),
+                                  discriminator.count(k)))
+
+        if kind == "Primitive" and record.get("format") in SUGGESTED_FORMATS \
+                and record["size"] == struct.calcsize("<" + record["format"]):
+            view, start = Reader(label, offset, 0, count)._column()
+            entry.samples.extend(struct.unpack_from(
+                f"<{count}{record['format']}", view, start))
+        if size:
+            segments.append((offset, size, entry))
+
+    for column_entries in Reader.sections.values():
+        for column_offset, entry_offset in column_entries.items():
+            entry = columns.get(column_offset)
+            if entry is not None:
+                tape_entry(entry, entry_offset)
+
+    # whatever lies between two columns is padding of the second one
+    segments.sort(key=lambda segment: segment[0])
+    end = 1
+    for offset, size, entry in segments:
+        if offset > end:
+            entry.padding += offset - end
+        end = max(end, offset + size)
+    report.region_size = end
+
+    for label, entry in report.paths.items():
+        record = schema[label]
+        entry.index = entry.index_slots * n
+        entry.length = entry.length_slots * m
+        entry.total = entry.payload + entry.index + \
+            entry.length + entry.padding + entry.tape
+        entry.dedup_ratio = None
+        entry.density = None
+        if entry.kind == "Optional":
+            present = sum(sum(discriminator) for discriminator in entry.discriminators)
+            entry.density = [present / entry.values] if entry.values else []
+        elif entry.kind == "OneOf":
+            entry.density = one_of_density(entry, len(record["children"]))
+        elif record.get("serialize") and entry.values:
+            # values per distinct string, each distinct one is stored once
+            entry.dedup_ratio = entry.values / len(set(entry.pointers))
+    report.suggestions = suggest_layouts(schema, report)
+    return report
+
+
+def one_of_density(entry, no_of_class):
+    counts = [0] * no_of_class
+    for discriminator in entry.discriminators:
+        for k in discriminator:
+            counts[k] += 1
+    return [count / entry.values for count in counts] if entry.values else []
+
+
+def suggest_layouts(schema, report):
+    suggestions = []
+    for label, entry in report.paths.items():
+        record = schema[label]
+        if not entry.values or record.get("name") == label:
+            # base types are shared by every path using them
+            continue
+        if entry.kind == "Primitive" and record.get("format") in ("b", "B", "h", "H", "i", "I"):
+            lo, hi = min(entry.samples), max(entry.samples)
+            name, size = next((name, size) for name, start, stop, size in INT_TYPES
+                              if start <= lo and hi < stop)
+            if size < record["size"]:
+                suggestions.append((label, f"values fit in {name}",
+                                    (record["size"] - size) * entry.values))
+        elif entry.kind == "Primitive" and record.get("format") == "d" and record["size"] == 8:
+            if all(struct.unpack("<f", struct.pack("<f", value))[0] == value
+                   for value in entry.samples):
+                suggestions.append((label, "values are exact in Float32",
+                                    4 * entry.values))
+        elif entry.kind in ("Optional", "OneOf"):
+            no_of_class = 2 if entry.kind == "Optional" else len(record["children"])
+            layouts = LAYOUTS if entry.kind == "OneOf" else LAYOUTS[:-1]
+            sizes = {layout: 0 for layout in layouts}
+            for discriminator in entry.discriminators:
+                for layout in layouts:
+                    sizes[layout] += len(encode_discriminator(
+                        discriminator, no_of_class, layout, entry.kind == "Optional"))
+            layout = min(sizes, key=sizes.get)
+            saved = entry.tape - sizes[layout]
+            if record.get("bitmask") not in (layout, "adaptive") and saved > 0:
+                suggestions.append((label, f'annotate {{"bitmask": "{layout}"}}', saved))
+    return sorted(suggestions, key=lambda suggestion: -suggestion[2])
+
+
+def format_report(report):
+    n, m = report.header
+    lines = [
+        f"header (n, m) = ({n}, {m})" + (" fixed width" if report.fixed_width else ""),
+        f"size {report.size} bytes, index region {report.region_size}, "
+        f"tape {report.size - report.region_size}",
+    ]
+
+    columns = ["path", "kind", "values", "payload", "index", "length", "padding", "tape", "total"]
+    rows = [[label, entry.kind, entry.values, entry.payload, entry.index, entry.length,
+             entry.padding, entry.tape, entry.total]
+            for label, entry in sorted(report.paths.items(), key=lambda item: -item[1].total)]
+    widths = [max(len(str(row[i])) for row in [columns, *rows]) for i in range(len(columns))]
+    lines.append("")
+    for row in [columns, *rows]:
+        lines.append("  ".join(str(cell).ljust(width) if i < 2 else str(cell).rjust(width)
+                               for i, (cell, width) in enumerate(zip(row, widths))))
+
+    details = []
+    for label, entry in report.paths.items():
+        if entry.dedup_ratio is not None:
+            details.append(f"{label}: string dedup ratio {entry.dedup_ratio:.2f}")
+        if entry.density:
+            density = ", ".join(f"{value:.1%}" for value in entry.density)
+            details.append(f"{label}: bitmask density {density}")
+    if details:
+        lines.extend(["", *details])
+
+    if report.suggestions:
+        lines.append("")
+        for label, suggestion, saved in report.suggestions:
+            lines.append(f"{label}: {suggestion}, saves ~{saved} bytes")
+    return "\n".join(lines)
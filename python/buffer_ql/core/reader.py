@@ -0,0 +1,1082 @@
+import struct
+import mmap
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import partial
+
+from ..helpers.bitmask_alt import decode_discriminator
+from ..helpers.bitmask import (
+    decode_bitmask,
+    decode_one_of,
+    forward_map_indexes,
+    forward_map_single_index,
+    index_to_one_of,
+    forward_map_one_of,
+    forward_map_single_one_of
+)
+from ..helpers.io import (
+    read_varint,
+    read_fixed_int,
+    read_string,
+    serialize_string,
+    Data_Tape,
+    FIXED_WIDTH
+)
+from ..helpers.lookup import bisect_keys, probe_hash_table
+from ..helpers.compression import decompress, item_width
+from ..helpers.cache import LRUCache
+from ..helpers.sections import INDEX_SECTION, STATS_SECTION, read_sections
+from ..helpers.stats import decode_zone_map, summarize_zone_maps, overlaps
+from ..helpers.aggregate import aggregate, histogram, group_by
+from ..schema.index import is_scalar
+
+
+class Symbol:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+ALL_KEYS = Symbol("ALL_KEYS")
+ALL_VALUES = Symbol("ALL_VALUES")
+NULL_VALUE = Symbol("NULL_VALUE")
+
+EMPTY_INDEX = range(0)
+
+
+def create_reader(data, schema, cache_size=64, cache_bytes=0):
+    data_view = memoryview(data).cast("B")
+    size_header = data_view[0]
+
+    class BaseReader(Reader):
+        pass
+
+    BaseReader.data_view = data_view
+    BaseReader.schema = schema
+    BaseReader.linked_readers = {}
+    BaseReader.index_size = size_header >> 4
+    BaseReader.length_size = size_header & 7
+    if size_header & FIXED_WIDTH:
+        BaseReader.read_index = staticmethod(partial(
+            read_fixed_int, size=BaseReader.index_size, signed=True))
+        BaseReader.read_length = staticmethod(partial(
+            read_fixed_int, size=BaseReader.length_size))
+    BaseReader.block_cache = LRUCache(cache_size)
+    # resolved slots, decoded bitmasks and strings of hot traversals
+    BaseReader.traversal_cache = LRUCache(
+        None, cache_bytes) if cache_bytes else None
+    BaseReader.sections = read_sections(data_view, Data_Tape.read_entry)
+    return BaseReader
+
+
+def container_stats(Reader, label):
+    """Min, max, null and value counts of a stats annotated path over the
+    whole container, read from the zone maps only"""
+    data_view = Reader.data_view
+    zone_maps = [
+        decode_zone_map(Data_Tape.read_entry(data_view, entry_offset))
+        for entry_offset in Reader.sections.get(STATS_SECTION, {}).values()
+    ]
+    return summarize_zone_maps(
+        zone_map for zone_map in zone_maps if zone_map[0] == label)
+
+
+def link_readers(readers):
+    for key_a, reader_a in readers.items():
+        for key_b, reader_b in readers.items():
+            if key_a == key_b:
+                continue
+            reader_a.add_link(key_b, reader_b)
+            reader_b.add_link(key_a, reader_a)
+
+
+class ReaderPool:
+    """Registry of linked containers, opened lazily with mmap
+
+    At most max_open containers are kept open, the least recently used one
+    is closed first. Readers obtained from an evicted container are released.
+    """
+
+    def __init__(self, max_open=8):
+        self.max_open = max_open
+        self.sources = {}
+        self.pinned = {}
+        self.opened = OrderedDict()
+
+    def register(self, schema_key, path, schema, root_type="#"):
+        self.sources[schema_key] = (path, schema, root_type)
+
+    def attach(self, Reader):
+        Reader.linked_readers = self
+        return Reader
+
+    def locate(self, schema_key, path=[], root_type=None):
+        _, _, default_root = self.sources.get(schema_key, (None, None, "#"))
+        reader = resolve(self[schema_key](root_type or default_root))
+        for key in path:
+            reader = reader.get(key)
+        return reader
+
+    def __contains__(self, schema_key):
+        return schema_key in self.pinned or schema_key in self.sources
+
+    def __setitem__(self, schema_key, Reader):
+        self.pinned[schema_key] = self.attach(Reader)
+
+    def __getitem__(self, schema_key):
+        if schema_key in self.pinned:
+            return self.pinned[schema_key]
+        opened = self.opened
+        if schema_key in opened:
+            opened.move_to_end(schema_key)
+            return opened[schema_key][0]
+
+        path, schema, _ = self.sources[schema_key]
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        Reader = self.attach(create_reader(mapped, schema))
+        opened[schema_key] = (Reader, mapped)
+        while len(opened) > self.max_open:
+            _, evicted = opened.popitem(last=False)
+            self._close(*evicted)
+        return Reader
+
+    def close(self):
+        while self.opened:
+            _, evicted = self.opened.popitem(last=False)
+            self._close(*evicted)
+
+    @staticmethod
+    def _close(Reader, mapped):
+        try:
+            Reader.data_view.release()
+            mapped.close()
+        except BufferError:
+            # values still hold views into the container, the mapping is
+            # closed once they are garbage collected
+            pass
+
+
+class Reader:
+    data_view = memoryview(b"")
+    schema = {}
+    linked_readers = {}
+    index_size = 4
+    length_size = 4
+    read_index = staticmethod(partial(read_varint, signed=True))
+    read_length = staticmethod(read_varint)
+    traversal_cache = None
+
+    def __init__(self, type_name, offset=1, index=0, length=1):
+        schema = self.context.schema
+        if type(self).__init__ is Reader.__init__ and type_name not in schema:
+            raise TypeError(f"Missing type definition {type_name} in schema")
+
+        self.type_name = type_name
+        self.current_type = schema.get(type_name)
+        self.current_offset = offset
+        self.current_index = index
+        self.current_length = length
+        self._is_nested_ref = False
+
+    def is_primitive(self):
+        return self.current_type["type"] == "Primitive"
+
+    def is_array(self):
+        return self.current_type["type"] == "Array"
+
+    def is_map(self):
+        return self.current_type["type"] == "Map"
+
+    def is_optional(self):
+        return self.current_type["type"] == "Optional"
+
+    def is_one_of(self):
+        return self.current_type["type"] == "OneOf"
+
+    def is_tuple(self):
+        return self.current_type["type"] == "Tuple"
+
+    def is_named_tuple(self):
+        return self.current_type["type"] == "NamedTuple"
+
+    def is_ref(self):
+        return self.current_type["type"] == "Ref"
+
+    def is_link(self):
+        return self.current_type["type"] == "Link"
+
+    def is_modifier(self):
+        return (
+            self.is_optional()
+            or self.is_one_of()
+            or self.is_ref()
+            or self.is_link()
+        )
+
+    def single_value(self):
+        return isinstance(self.current_index, int)
+
+    def is_undefined(self, at_index=None):
+        if at_index is None:
+            at_index = self.current_index
+        if self.current_offset < 0:
+            return True
+        if isinstance(at_index, int):
+            return at_index < 0 or at_index >= self.current_length
+        return len(at_index) == 0
+
+    def is_branched(self):
+        return False
+
+    def value(self, ref_cache=None):
+        if self.is_primitive():
+            if self.single_value():
+                return self._primitive_value_at(self.current_index)
+            return [self._primitive_value_at(i) for i in self.current_index]
+        # a referenced value is decoded once and shared by all its Refs
+        if ref_cache is None:
+            ref_cache = {}
+        if self.single_value():
+            return self._compound_value_at(self.current_index, ref_cache)
+        return [self._compound_value_at(i, ref_cache) for i in self.current_index]
+
+    def iter_rows(self, batch_size=1024, cache_bytes=1 << 24):
+        """Yields the values of a column (or of the elements of a single
+        array) in order, decoding batch_size rows at a time column by column"""
+        items = self.get(ALL_VALUES) if self.is_array() and self.single_value() else self
+        current_index = items.current_index
+        if isinstance(current_index, int):
+            yield items.value()
+            return
+        if items.is_branched():
+            root_index = items.root_index
+            for i in range(0, len(root_index), batch_size):
+                yield from BranchedReader(items.branches, items.current_branch, items.discriminator,
+                                          root_index[i: i + batch_size]).value()
+            return
+
+        # bitmask forward maps and slots are resolved once for all batches
+        context = items.context
+        if context.traversal_cache is None:
+            context = type("StreamingReader", (context,), {
+                "traversal_cache": LRUCache(None, cache_bytes)})
+        for i in range(0, len(current_index), batch_size):
+            batch = context(items.type_name, items.current_offset,
+                            current_index[i: i + batch_size], items.current_length)
+            batch._is_nested_ref = items._is_nested_ref
+            yield from column_values(batch)
+
+    def _column_values(self):
+        # values at every position of a multi valued reader, decoded column
+        # by column instead of row by row
+        current_index = self.current_index
+        if self.current_offset < 0:
+            return [None] * len(current_index)
+
+        if self.is_primitive():
+            if is_scalar(self.current_type):
+                return list(self._scalar_values())
+            return self.value()
+        elif self.is_named_tuple() or self.is_tuple():
+            current_type = self.current_type
+            keys = current_type.get("keys") or range(len(current_type["children"]))
+            columns = [column_values(self.get(key)) for key in keys]
+            rows = []
+            for k, i in enumerate(current_index):
+                if self.is_undefined(i):
+                    rows.append(None)
+                elif self.is_tuple():
+                    rows.append([column[k] for column in columns])
+                else:
+                    row = {key: column[k] for key, column in zip(keys, columns)}
+                    bind = current_type.get("bind")
+                    rows.append(row if bind is None else bind.construct(row))
+            return rows
+        elif self.is_array() and not self._is_nested_ref:
+            return [
+                None if reader.single_value() else column_values(reader)
+                for reader in self.get(ALL_VALUES).readers
+            ]
+        return self.value()
+
+    def _primitive_value_at(self, at_index):
+        if self.is_undefined(at_index):
+            return None
+        _size, decode = self.current_type["size"], self.current_type["decode"]
+        if type(_size) == int:
+            data_view, offset = self._column()
+            return decode(data_view, offset + at_index * _size)
+        offset = self.current_offset + at_index * self.context.index_size
+        return self._cached(
+            ("value", offset), lambda: decode(self.context.data_view, offset))
+
+    def _cached(self, key, compute):
+        cache = self.context.traversal_cache
+        if cache is None:
+            return compute()
+        value = cache.get(key)
+        if value is None:
+            value = cache.put(key, compute())
+        return value
+
+    def _column(self):
+        # compressed columns are decoded from their decompressed block, only
+        # the blocks a query actually touches are ever decompressed
+        context = self.context
+        current_type = self.current_type
+        compression = current_type.get("compression")
+        if not compression:
+            return context.data_view, self.current_offset
+        block = context.block_cache.get(self.current_offset)
+        if block is None:
+            block = memoryview(decompress(
+                compression,
+                Data_Tape.read_entry(context.data_view, self.current_offset),
+                current_type["size"],
+                item_width(current_type)
+            ))
+            context.block_cache.put(self.current_offset, block)
+        return block, 0
+
+    def _compound_value_at(self, at_index, ref_cache):
+        if self.is_undefined(at_index):
+            return None
+        root = [None]
+        current_stack = []
+        if at_index == self.current_index:
+            current_stack.append((self, root, 0))
+        else:
+            current_stack.append((self._next_reader(
+                self.type_name, self.current_offset, at_index, self.current_length), root, 0))
+        while current_stack:
+            current_reader, parent, key = current_stack.pop()
+            current_reader._value(parent, key, current_stack, ref_cache)
+        return root[0]
+
+    def _value(self, parent, key, current_stack, ref_cache):
+        parent[key] = None
+        if not self.single_value() or self.is_undefined():
+            return
+
+        if self.is_branched():
+            parent[key] = self.value(ref_cache)
+            return
+
+        current_type = self.current_type
+        cache_key = (self.current_offset, self.current_index)
+        if current_type.get("ref"):
+            cached = ref_cache.get(cache_key)
+            if cached is not None:
+                parent[key] = cached
+                return
+
+        if self.is_primitive():
+            parent[key] = self._primitive_value_at(self.current_index)
+            return
+        elif self.is_tuple():
+            children = current_type["children"]
+            value = [None] * len(children)
+            for k in range(len(children) - 1, -1, -1):
+                current_stack.append((self.get(k), value, k))
+        elif self.is_named_tuple():
+            keys = current_type["keys"]
+            value = {}
+            bind = current_type.get("bind")
+            if bind is not None:
+                # runs once every field below has been decoded
+                current_stack.append((Construct(bind, cache_key, ref_cache), parent, key))
+            for k in range(len(keys) - 1, -1, -1):
+                current_stack.append((self.get(keys[k]), value, keys[k]))
+        elif self.is_array():
+            value = self.get(ALL_VALUES).value(ref_cache)
+        elif self.is_map():
+            child_keys = self.get(ALL_KEYS).value()
+            value = {}
+            for k in range(len(child_keys) - 1, -1, -1):
+                child_key = child_keys[k]
+                current_stack.append((self.get(child_key), value, child_key))
+        else:
+            return
+
+        parent[key] = value
+        if current_type.get("ref"):
+            ref_cache[cache_key] = value
+
+    def get(self, key):
+        if isinstance(key, list) and not self.is_array() and not self.is_map():
+            raise ValueError("Only Array or Map type supports multi-key access")
+
+        current_type = self.current_type
+        current_offset = self.current_offset
+        current_index = self.current_index
+        current_length = self.current_length
+        context = self.context
+
+        if self.is_tuple():
+            if not isinstance(key, int):
+                raise TypeError("Tuple type can only be accessed by index")
+            children = current_type["children"]
+            if key < 0 or key >= len(children):
+                raise IndexError(f"Index {key} is out of bounds")
+            next_offset = -1 if self.is_undefined() else context.read_index(
+                context.data_view, current_offset + key * context.index_size)
+            return self._next_reader(children[key], next_offset, current_index, current_length)
+
+        elif self.is_named_tuple():
+            if not isinstance(key, str):
+                raise TypeError("Named tuple type can only be accessed by key")
+            indexes = current_type["indexes"]
+            if key not in indexes:
+                raise KeyError(f"Undefined key {key}")
+            i = indexes[key]
+            if current_type.get("packed"):
+                return self._next_reader(
+                    current_type["packed_fields"][i], current_offset, current_index, current_length)
+            offset = current_offset + i * context.index_size
+            next_offset = -1 if self.is_undefined() else self._cached(
+                ("slot", offset), lambda: context.read_index(context.data_view, offset))
+            return self._next_reader(current_type["children"][i], next_offset, current_index, current_length)
+
+        elif self.is_array():
+            if self.single_value():
+                return self._array_reader_get(current_index, key)
+            return NestedReader(
+                [self._array_reader_get(i, key) for i in current_index],
+                self._array_reader_get(ALL_VALUES, key)
+            )
+
+        elif self.is_map():
+            if self.single_value():
+                return self._map_reader_get(current_index, key)
+            return NestedReader(
+                [self._map_reader_get(i, key) for i in current_index],
+                self._map_reader_get(ALL_VALUES, key)
+            )
+
+        elif self.is_optional():
+            next_type = current_type["children"][0]
+            if self.is_undefined():
+                return self._next_reader(next_type, -1, current_index, current_length)
+
+            def decode():
+                encoded = Data_Tape.read(context.data_view, current_offset)
+                if current_type.get("bitmask"):
+                    return decode_discriminator(encoded, current_length, 2, True)
+                return decode_bitmask(encoded, current_length)
+            next_offset = context.read_index(
+                context.data_view, current_offset + context.index_size)
+            if context.traversal_cache is not None:
+                forward_map = self._cached(
+                    ("optional", current_offset, current_length),
+                    lambda: forward_map_indexes(decode()).materialize())
+                if self.single_value():
+                    next_index = -1 if current_index < 0 or current_index >= len(
+                        forward_map) else forward_map[current_index]
+                else:
+                    next_index = [
+                        -1 if i < 0 or i >= len(forward_map) else forward_map[i]
+                        for i in current_index
+                    ]
+            elif self.single_value():
+                next_index = forward_map_single_index(current_index, decode())
+            else:
+                forward_map = forward_map_indexes(decode()).materialize()
+                next_index = [
+                    -1 if i < 0 or i >= len(forward_map) else forward_map[i]
+                    for i in current_index
+                ]
+            return self._next_reader(next_type, next_offset, next_index, current_length)
+
+        elif self.is_one_of():
+            return BranchedReader.from_reader(self)
+
+        elif self.is_ref():
+            if self.single_value():
+                return self._ref_reader_get(current_index)
+            return NestedReader(
+                [self._ref_reader_get(i) for i in current_index],
+                self._ref_reader_get(-1)
+            )
+
+        elif self.is_link():
+            if self.single_value():
+                return self._link_reader_get(current_index)
+            return NestedReader(
+                [self._link_reader_get(i) for i in current_index],
+                self._link_reader_get(-1)
+            )
+
+        raise TypeError("Primitive types cannot be traversed further")
+
+    def _array_reader_get(self, at_index, i):
+        context = self.context
+        next_type = self.current_type["children"][0]
+        next_index = self._validate_array_key(i)
+
+        if at_index is ALL_VALUES or self._is_nested_ref:
+            return self._next_reader(
+                next_type, -1, -1 if isinstance(next_index, int) else EMPTY_INDEX, 0)
+        if self.is_undefined(at_index):
+            return self._next_reader(next_type, -1, -1, 0)
+
+        offset = self.current_offset + at_index * \
+            (context.index_size + context.length_size)
+        next_offset, next_length = self._cached(("array", offset), lambda: (
+            context.read_index(context.data_view, offset),
+            context.read_length(context.data_view, offset + context.index_size)
+        ))
+        return self._next_reader(
+            next_type,
+            next_offset,
+            range(next_length) if next_index is None else next_index,
+            next_length
+        )
+
+    def _validate_array_key(self, i):
+        if isinstance(i, int):
+            return i
+        if isinstance(i, list):
+            for v in i:
+                if not isinstance(v, int):
+                    raise TypeError(
+                        "Index must be a number, a set of numbers or ALL_VALUES")
+            return i
+        if i is not ALL_VALUES:
+            raise TypeError(
+                "Index must be a number, a set of numbers or ALL_VALUES")
+        return None
+
+    def _map_reader_get(self, at_index, k):
+        context = self.context
+        data_view = context.data_view
+        index_size = context.index_size
+        next_type = self.current_type["children"][0]
+        next_is_single = self._validate_map_key(k)
+
+        if at_index is ALL_VALUES or self._is_nested_ref:
+            return self._next_reader(
+                next_type, -1, -1 if next_is_single else EMPTY_INDEX, 0)
+        if self.is_undefined(at_index):
+            return self._next_reader(next_type, -1, -1, 0)
+
+        key_index = self.current_type.get("key_index")
+        stride = 2 * index_size + context.length_size
+        if key_index == "hash":
+            stride += index_size
+        offset = self.current_offset + at_index * stride
+        offset_to_keys = context.read_index(data_view, offset)
+        offset_to_values = context.read_index(data_view, offset + index_size)
+        next_length = context.read_length(data_view, offset + 2 * index_size)
+
+        def read_key(i):
+            return Data_Tape.read(data_view, offset_to_keys + i * index_size)
+
+        if key_index == "sorted":
+            def get_index(key):
+                return bisect_keys(next_length, serialize_string(key), read_key)
+        elif key_index == "hash":
+            table = Data_Tape.read(
+                data_view, offset + 2 * index_size + context.length_size)
+
+            def get_index(key):
+                return probe_hash_table(table, serialize_string(key), read_key)
+        else:
+            def get_index(key):
+                for i in range(next_length):
+                    if key == read_string(data_view, offset_to_keys + i * index_size):
+                        return i
+                return -1
+
+        if isinstance(k, str):
+            next_index = get_index(k)
+        elif isinstance(k, list):
+            next_index = [get_index(key) for key in k]
+        else:
+            next_index = range(next_length)
+
+        return self._next_reader(
+            "String" if k is ALL_KEYS else next_type,
+            offset_to_keys if k is ALL_KEYS else offset_to_values,
+            next_index,
+            next_length
+        )
+
+    def _validate_map_key(self, k):
+        if isinstance(k, str):
+            return True
+        if isinstance(k, list):
+            for v in k:
+                if not isinstance(v, str):
+                    raise TypeError(
+                        "Key must be a string, a set of strings, ALL_VALUES or ALL_KEYS")
+            return False
+        if k is not ALL_VALUES and k is not ALL_KEYS:
+            raise TypeError(
+                "Key must be a string, a set of strings, ALL_VALUES or ALL_KEYS")
+        return False
+
+    def _ref_reader_get(self, at_index):
+        context = self.context
+        next_type = self.current_type["children"][0]
+        if self.is_undefined(at_index):
+            return self._next_reader(next_type, -1, -1, 0)
+
+        offset = self.current_offset + at_index * \
+            (context.index_size + context.length_size)
+        next_offset = context.read_index(context.data_view, offset)
+        next_index = context.read_length(context.data_view, offset + context.index_size)
+        return self._next_reader(next_type, next_offset, next_index, next_index + 1)
+
+    def _link_reader_get(self, at_index):
+        context = self.context
+        link = self.current_type["children"][0]
+        schema_key, next_type = link.split("/", 1)
+        undefined = self.is_undefined(at_index)
+        offset = self.current_offset + at_index * 8
+        if undefined:
+            next_offset, next_index = -1, -1
+        else:
+            next_offset = int.from_bytes(
+                context.data_view[offset: offset + 4], "little", signed=True)
+            next_index = int.from_bytes(
+                context.data_view[offset + 4: offset + 8], "little", signed=True)
+
+        if schema_key in context.linked_readers:
+            LinkedReader = context.linked_readers[schema_key]
+            return resolve(LinkedReader(next_type, next_offset, next_index, next_index + 1))
+        elif self.is_undefined():
+            return self
+        raise ValueError(f"Reader not found for link {link}")
+
+    def dump(self, fmt=None):
+        if not self.is_primitive():
+            raise TypeError("Calling dump on a non-primitive type")
+        if type(self.current_type["size"]) != int:
+            raise TypeError("Calling dump on a variable size primitive type")
+        offset, length = self._compute_dump()
+        if length <= 0:
+            return memoryview(b"").cast(fmt or "B")
+        if not self.current_type.get("compression"):
+            data_view = self.context.data_view
+        elif isinstance(self, NestedReader):
+            raise ValueError("Calling dump across compressed blocks")
+        else:
+            data_view, base = self._column()
+            offset += base - self.current_offset
+        dumped = data_view[offset: offset + length]
+        return dumped.cast(fmt or self.current_type.get("format", "B"))
+
+    def value_length(self):
+        if isinstance(self.current_index, int):
+            return -1
+        return len(self.current_index)
+
+    def lookup(self, value):
+        """Indexes of the elements equal to value in an indexed column"""
+        if not self.is_primitive() or not self.current_type.get("indexed"):
+            raise TypeError("Calling lookup on a column without index")
+        if self.current_offset < 0:
+            return []
+        context = self.context
+        entry_offset = context.sections.get(
+            INDEX_SECTION, {}).get(self.current_offset)
+        if entry_offset is None:
+            raise ValueError("Index not found for column")
+        permutation = Data_Tape.read_entry(context.data_view, entry_offset)
+
+        def value_at(k):
+            i = struct.unpack_from("<I", permutation, 4 * k)[0]
+            return self._primitive_value_at(i)
+
+        n = len(permutation) // 4
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value_at(mid) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        indexes = []
+        while lo < n and value_at(lo) == value:
+            indexes.append(struct.unpack_from("<I", permutation, 4 * lo)[0])
+            lo += 1
+        return sorted(indexes)
+
+    def _scalar_values(self):
+        # per position values of a numeric column, read straight from a
+        # typed view of the column, None where the position is null
+        if not self.is_primitive():
+            raise TypeError("Calling an aggregate on a non-primitive type")
+        current_index = self.current_index
+        if self.single_value():
+            current_index = [current_index]
+        if self.current_offset < 0:
+            return [None] * len(current_index)
+        current_type = self.current_type
+        if not is_scalar(current_type):
+            return [self._primitive_value_at(i) for i in current_index]
+
+        size = current_type["size"]
+        count = max(current_index, default=-1) + 1
+        data_view, offset = self._column()
+        column = data_view[offset: offset + count * size].cast(current_type["format"])
+        if isinstance(current_index, range) and current_index.step == 1:
+            return column[current_index.start: current_index.stop]
+        return [None if i < 0 else column[i] for i in current_index]
+
+    def aggregate(self, op):
+        """count, sum, mean, min or max over the non-null values"""
+        values = self._scalar_values()
+        if not isinstance(values, memoryview):
+            values = [value for value in values if value is not None]
+        return aggregate(values, op)
+
+    def histogram(self, edges):
+        return histogram(
+            (value for value in self._scalar_values() if value is not None), edges)
+
+    def group_by(self, keys, op):
+        """Aggregate of the values per distinct value of keys, a reader at
+        the same positions (usually a small cardinality column)"""
+        return group_by(keys._scalar_values(), self._scalar_values(), op)
+
+    def rows(self):
+        """Raw struct tuples of a packed NamedTuple, one unpack per row"""
+        row = self.current_type.get("row")
+        if row is None:
+            raise TypeError("Calling rows on a reader of a non-packed type")
+        data_view = self.context.data_view
+
+        def row_at(i):
+            if self.is_undefined(i):
+                return None
+            return row.unpack_from(data_view, self.current_offset + i * row.size)
+        if self.single_value():
+            return row_at(self.current_index)
+        return [row_at(i) for i in self.current_index]
+
+    def zone_map(self):
+        if self.current_offset < 0:
+            return None
+        entry_offset = self.context.sections.get(
+            STATS_SECTION, {}).get(self.current_offset)
+        if entry_offset is None:
+            return None
+        return decode_zone_map(Data_Tape.read_entry(self.context.data_view, entry_offset))
+
+    def between(self, lo, hi):
+        """Positions of the values within [lo, hi], skipping the values of
+        blocks whose zone map rules them out"""
+        if not self.is_primitive() or self.single_value():
+            raise TypeError("Calling between on a non-primitive or single value reader")
+        current_index = self.current_index
+        zone_map = self.zone_map()
+        starts = [0]
+        skipped = [False]
+        if zone_map is not None:
+            # blocks cover block_size source values, nulls included for an
+            # Optional column, their first index in this column is the
+            # running count of non null values
+            _, block_size, count, blocks = zone_map
+            starts = []
+            skipped = []
+            start = 0
+            for b, block in enumerate(blocks):
+                starts.append(start)
+                skipped.append(not overlaps(block, lo, hi))
+                start += min(block_size, count - b * block_size) - block[2]
+
+        matched = []
+        for k, index in enumerate(current_index):
+            if skipped[bisect_right(starts, index) - 1]:
+                continue
+            value = self._primitive_value_at(index)
+            if value is not None and lo <= value <= hi:
+                matched.append(k)
+        return matched
+
+    def _compute_dump(self):
+        size = self.current_type["size"]
+        current_offset = self.current_offset
+        current_length = self.current_length
+
+        if self.single_value():
+            index = self.current_index
+            if index < 0 or index >= current_length:
+                return -1, 0
+            return current_offset + index * size, size
+
+        offset = -1
+        last_index = -1
+        length = 0
+        for index in self.current_index:
+            if index < 0 or index >= current_length:
+                continue
+            if offset < 0:
+                offset = current_offset + index * size
+            elif index > last_index + 1:
+                raise ValueError("Calling dump on non-contiguous block")
+            length += size
+            last_index = index
+        return offset, length
+
+    def _next_reader(self, type_name, offset, index, length):
+        next_reader = self.context(type_name, offset, index, length)
+        next_reader._is_nested_ref = self._is_nested_ref
+        return resolve(next_reader)
+
+    @property
+    def context(self):
+        return type(self)
+
+    @classmethod
+    def add_link(cls, schema_key, LinkedReader):
+        cls.linked_readers[schema_key] = LinkedReader
+
+
+class NestedReader(Reader):
+    def __init__(self, readers, ref):
+        self.readers = readers
+        self.ref = ref
+        super().__init__(ref.type_name, ref.current_offset,
+                         ref.current_index, ref.current_length)
+        self.current_type = ref.current_type
+        ref._is_nested_ref = True
+
+    def single_value(self):
+        return False
+
+    def is_undefined(self, at_index=None):
+        if not isinstance(at_index, int):
+            return False
+        return self.readers[at_index].is_undefined()
+
+    def is_branched(self):
+        return self.ref.is_branched()
+
+    def switch_branch(self, branch_index):
+        if not self.is_branched():
+            return self
+        return NestedReader(
+            [reader.switch_branch(branch_index) for reader in self.readers],
+            self.ref.switch_branch(branch_index)
+        )
+
+    def value(self, ref_cache=None):
+        return [reader.value(ref_cache) if reader else None for reader in self.readers]
+
+    def get(self, key):
+        return NestedReader(
+            [reader.get(key) for reader in self.readers],
+            self.ref.get(key)
+        )
+
+    def value_length(self):
+        return len(self.readers)
+
+    def lookup(self, value):
+        return [reader.lookup(value) for reader in self.readers]
+
+    def between(self, lo, hi):
+        return [reader.between(lo, hi) for reader in self.readers]
+
+    def aggregate(self, op):
+        # one reduction per segment, the outer array lengths being the
+        # segment boundaries
+        return [reader.aggregate(op) for reader in self.readers]
+
+    def histogram(self, edges):
+        return [reader.histogram(edges) for reader in self.readers]
+
+    def group_by(self, keys, op):
+        return [reader.group_by(key_reader, op)
+                for reader, key_reader in zip(self.readers, keys.readers)]
+
+    def _compute_dump(self):
+        offset = -1
+        length = 0
+        for reader in self.readers:
+            next_offset, next_length = reader._compute_dump()
+            if next_length == 0:
+                continue
+            if offset < 0:
+                offset = next_offset
+            elif next_offset > offset + length:
+                raise ValueError("Calling dump on non-contiguous block")
+            length += next_length
+        return offset, length
+
+    @property
+    def context(self):
+        return self.ref.context
+
+
+class BranchedReader(Reader):
+    @staticmethod
+    def from_reader(root):
+        if not root.is_one_of():
+            raise TypeError("Expects OneOf type")
+
+        context = root.context
+        data_view = context.data_view
+        current_offset = root.current_offset
+        current_index = root.current_index
+        current_length = root.current_length
+        children = root.current_type["children"]
+
+        if root.is_undefined():
+            branches = [
+                root._next_reader(next_type, -1, current_index, current_length)
+                for next_type in children
+            ]
+            return BranchedReader(branches, 0, [], current_index)
+
+        def decode():
+            encoded = Data_Tape.read(data_view, current_offset)
+            if root.current_type.get("bitmask"):
+                return decode_discriminator(encoded, current_length, len(children))
+            return decode_one_of(encoded, current_length, len(children))
+        if context.traversal_cache is not None:
+            one_of_index = root._cached(
+                ("one_of", current_offset, current_length), lambda: list(decode()))
+        else:
+            one_of_index = decode()
+
+        def branch_offset(i):
+            return context.read_index(data_view, current_offset + context.index_size * (i + 1))
+
+        if root.single_value():
+            discriminator, branch_next_index = forward_map_single_one_of(
+                current_index, one_of_index, len(children))
+            branches = [
+                root._next_reader(
+                    next_type,
+                    branch_offset(i),
+                    branch_next_index if i == discriminator else -1,
+                    current_length
+                )
+                for i, next_type in enumerate(children)
+            ]
+            return BranchedReader(branches, 0, discriminator, current_index)
+
+        def maps():
+            return (
+                list(index_to_one_of(one_of_index, len(children))),
+                [list(forward_map) for forward_map in forward_map_one_of(
+                    one_of_index, len(children))]
+            )
+        if context.traversal_cache is not None:
+            # batches over the same column share the maps
+            discriminator, forward_maps = root._cached(
+                ("one_of_maps", current_offset, current_length), maps)
+        else:
+            discriminator, forward_maps = maps()
+        branches = [
+            root._next_reader(
+                next_type,
+                branch_offset(i),
+                forward_maps[i],
+                current_length
+            )
+            for i, next_type in enumerate(children)
+        ]
+        return BranchedReader(branches, 0, discriminator, current_index)
+
+    def __init__(self, branches, current_branch, discriminator, root_index):
+        self.branches = branches
+        self.current_branch = current_branch
+        self.discriminator = discriminator
+        self.root_index = root_index
+        branch = branches[current_branch]
+        super().__init__(branch.type_name, branch.current_offset,
+                         branch.current_index, branch.current_length)
+        self.current_type = branch.current_type
+        self._is_nested_ref = branch._is_nested_ref
+
+    def single_value(self):
+        if not isinstance(self.root_index, int):
+            return False
+        return self.branches[self.discriminator].single_value()
+
+    def is_undefined(self, at_index=None):
+        return super().is_undefined(self.root_index if at_index is None else at_index)
+
+    def is_branched(self):
+        return True
+
+    def switch_branch(self, branch_index):
+        return BranchedReader(self.branches, branch_index, self.discriminator, self.root_index)
+
+    def value(self, ref_cache=None):
+        discriminator = self.discriminator
+        if self.single_value():
+            return self.branches[discriminator].value(ref_cache)
+        # only the positions of root_index are decoded, each branch over
+        # the part of them it holds
+        root_index = self.root_index
+        values = [None] * len(root_index)
+        positions = [[] for _ in self.branches]
+        for k, i in enumerate(root_index):
+            if 0 <= i < len(discriminator):
+                positions[discriminator[i]].append(k)
+        for branch, branch_positions in zip(self.branches, positions):
+            if not branch_positions:
+                continue
+            branch_index = branch.current_index
+            if isinstance(branch, (NestedReader, BranchedReader)) or isinstance(branch_index, int):
+                branch_value = branch.value(ref_cache)
+                for k in branch_positions:
+                    i = root_index[k]
+                    values[k] = branch_value[i] if branch_value and i < len(branch_value) else None
+                continue
+            subset = branch.context(branch.type_name, branch.current_offset,
+                                    [branch_index[root_index[k]] for k in branch_positions],
+                                    branch.current_length)
+            subset.current_type = branch.current_type
+            subset._is_nested_ref = branch._is_nested_ref
+            for k, value in zip(branch_positions, subset.value(ref_cache)):
+                values[k] = value
+        return values
+
+    def get(self, key):
+        next_branches = list(self.branches)
+        next_branches[self.current_branch] = super().get(key)
+        return BranchedReader(next_branches, self.current_branch, self.discriminator, self.root_index)
+
+    def value_length(self):
+        if isinstance(self.root_index, int):
+            return -1
+        return len(self.root_index)
+
+    @property
+    def context(self):
+        return self.branches[self.current_branch].context
+
+
+class Construct:
+    def __init__(self, bind, cache_key, ref_cache):
+        self.bind = bind
+        self.cache_key = cache_key
+        self.ref_cache = ref_cache
+
+    def _value(self, parent, key, current_stack, ref_cache):
+        parent[key] = self.bind.construct(parent[key])
+        if self.cache_key in self.ref_cache:
+            self.ref_cache[self.cache_key] = parent[key]
+
+
+def column_values(reader):
+    if reader.is_branched() or isinstance(reader, NestedReader):
+        return reader.value()
+    return reader._column_values()
+
+
+def resolve(reader):
+    # modifiers are transparent, a reader landing on one moves straight
+    # through to the type it wraps
+    if reader.is_modifier() and not isinstance(reader, (NestedReader, BranchedReader)):
+        return reader.get(NULL_VALUE)
+    return reader
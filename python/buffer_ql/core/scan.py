@@ -0,0 +1,67 @@
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, reduce as fold
+
+from .reader import create_reader
+
+# schemas built by each worker, once per factory
+_schemas = {}
+
+
+def store_items(path, offsets):
+    """Scan items of a multi-container file, offsets as returned by
+    encode_many(..., concat=True)"""
+    return [(path, start, end) for start, end in zip(offsets, offsets[1:])]
+
+
+def scan(items, schema_factory, fn, reduce=None, initial=None, processes=None):
+    """Runs fn(Reader) on every container in a process pool
+
+    items are file paths or (path, start, end) ranges of a multi-container
+    file. Workers receive only the item and map the file themselves, so no
+    container bytes are pickled. schema_factory and fn are pickled by
+    reference, they have to be module level functions. With processes=0 the
+    scan runs in the calling process.
+
+    Returns the list of results, or their fold with reduce (starting from
+    initial when given).
+    """
+    task = partial(_scan_one, schema_factory, fn)
+    if processes == 0:
+        results = map(task, items)
+        return _combine(results, reduce, initial)
+    with ProcessPoolExecutor(processes) as executor:
+        results = executor.map(task, items)
+        return _combine(results, reduce, initial)
+
+
+def _combine(results, reduce, initial):
+    if reduce is None:
+        return list(results)
+    if initial is None:
+        return fold(reduce, results)
+    return fold(reduce, results, initial)
+
+
+def _scan_one(schema_factory, fn, item):
+    schema = _schemas.get(schema_factory)
+    if schema is None:
+        schema = _schemas[schema_factory] = schema_factory()
+
+    path, start, end = (item, 0, None) if isinstance(item, (str, bytes)) or \
+        not isinstance(item, tuple) else item
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)[start:end]
+    Reader = create_reader(view, schema)
+    try:
+        return fn(Reader)
+    finally:
+        try:
+            Reader.data_view.release()
+            view.release()
+            mapped.close()
+        except BufferError:
+            # results still hold views into the container, the mapping is
+            # closed once they are garbage collected
+            pass
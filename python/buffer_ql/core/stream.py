@@ -0,0 +1,106 @@
+import codecs
+import json
+import re
+
+# what may still follow a number cut at the end of the buffer
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*\Z")
+
+
+def iter_ndjson(fp):
+    """Records of a newline delimited JSON file, one line in memory at a time"""
+    for line in fp:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_array(fp, buffer_size=1 << 16):
+    """Elements of a top level JSON array, decoded incrementally so that
+    the text of the whole file is never held in memory"""
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill(size=buffer_size):
+        nonlocal buffer, pos, eof
+        chunk = fp.read(size)
+        if isinstance(chunk, bytes):
+            chunk = text_decoder.decode(chunk, final=not chunk)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def next_token():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                raise ValueError("Unexpected end of JSON input")
+            fill()
+
+    if next_token() != "[":
+        raise ValueError("Expects a JSON array at the top level")
+    pos += 1
+    if next_token() == "]":
+        return
+
+    # reads double while an element stays incomplete, a large one is only
+    # parsed again a logarithmic number of times
+    size = buffer_size
+    while True:
+        next_token()
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill(size)
+            size *= 2
+            continue
+        if (
+            not eof
+            and type(value) in (int, float)
+            and NUMBER_TAIL.match(buffer, end)
+        ):
+            # the number may continue in the next chunk, e.g. "1." or "10e"
+            fill(size)
+            size *= 2
+            continue
+        size = buffer_size
+        yield value
+        pos = end
+
+        token = next_token()
+        pos += 1
+        if token == "]":
+            return
+        if token != ",":
+            raise ValueError(f"Unexpected {token!r} in JSON array")
+
+
+def encode_chunks(encode, records, root_type, chunk_size=None):
+    """Encodes an iterable of records into containers of at most chunk_size
+    records each, root_type being an Array type. Only one chunk of records
+    is alive at any time."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if chunk_size is not None and len(chunk) >= chunk_size:
+            yield encode(chunk, root_type)
+            chunk = []
+    if chunk or chunk_size is None:
+        yield encode(chunk, root_type)
+
+
+def encode_stream(encode, records, root_type, path=()):
+    """Encodes an iterable of records into a single container, appending
+    each one to the Array at path (see Builder). Records are broken into
+    column buffers as they arrive, none is kept, so peak memory follows
+    the column data rather than the decoded input."""
+    builder = encode.builder(root_type)
+    builder.extend(path, records)
+    return builder.finish()
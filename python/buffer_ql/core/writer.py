@@ -1,3 +1,5 @@
+import struct
+from array import array
 from types import SimpleNamespace
 from ..helpers.bitmask import (
     encode_bitmask,
@@ -5,14 +7,55 @@ from ..helpers.bitmask import (
     bit_to_index,
     backward_map_indexes,
     one_of_to_index,
+    index_to_bit,
+    index_to_one_of,
     backward_map_one_of
 )
-from ..helpers.io import size_varint, write_varint, Data_Tape
+from ..helpers.bitmask_alt import encode_discriminator
+from ..helpers.io import (
+    size_varint,
+    write_varint,
+    write_fixed_int,
+    serialize_string,
+    Data_Tape,
+    FIXED_WIDTH
+)
+from ..helpers.lookup import encode_hash_table
+from ..helpers.sections import (
+    INDEX_SECTION,
+    STATS_SECTION,
+    TRAILER,
+    create_directory,
+    fill_directory,
+    encode_trailer
+)
+from ..helpers.compression import compress, item_width
+from ..helpers.stats import encode_zone_map
+from ..helpers.cache import LRUCache
+
+from ..schema.base import encode_int32, TYPE_CHECKS
+from ..schema.binding import field_columns
+from ..schema.validate import validate_data
+from .builder import Builder
+
+
+def create_encoder(schema, hash_threshold=None, plan_cache_size=0, fixed_width=False,
+                   dedup=False, trusted=False, validate=False):
+    if fixed_width:
+        # plain little endian slots, a column of them can be read with a
+        # single struct / np.frombuffer call
+        def write_index(dv, offset, value, size):
+            write_fixed_int(dv, offset, value, size, True)
 
-from ..schema.base import encode_int32
+        def write_length(dv, offset, value, size):
+            write_fixed_int(dv, offset, value, size)
+    else:
+        def write_index(dv, offset, value, size):
+            write_varint(dv, offset, value, True)
 
+        def write_length(dv, offset, value, size):
+            write_varint(dv, offset, value)
 
-def create_encoder(schema):
     class Writer:
         def __init__(self, type_name, source):
             self.type_name = type_name
@@ -20,6 +63,9 @@ def create_encoder(schema):
             self.current_source = source
             self.current_offset = -1
             self.bitmask = None
+            self.tape_offsets = None
+            self.key_tables = None
+            self.slots = None
             self.branches = []
             self.allocated = SimpleNamespace(
                 index_size=0, length_size=0, unit_size=0)
@@ -58,6 +104,33 @@ def create_encoder(schema):
         def is_null(self):
             return len(self.current_source) == 0
 
+        def is_structural(self):
+            # slots written from the shape alone, without values or tape offsets
+            current_type = self.current_type
+            if current_type.get("packed") or current_type.get("indexed") or current_type.get("stats"):
+                return False
+            if self.is_tuple() or self.is_named_tuple() or self.is_array():
+                pass
+            elif not self.is_map() or self.current_type.get("key_index") == "hash":
+                return False
+            # compressed children live on the tape and move with its content
+            return not any(
+                leaf.current_type.get("compression")
+                for branch in self.branches for leaf in as_leaves(branch)
+            )
+
+        def uses_tape(self):
+            # whether allocate puts anything on the data tape, otherwise it
+            # only counts slots
+            current_type = self.current_type
+            if current_type.get("indexed") or current_type.get("stats"):
+                return True
+            if self.is_primitive():
+                return bool(current_type.get("compression")) or callable(current_type["size"])
+            if self.is_map():
+                return current_type.get("key_index") == "hash"
+            return self.is_optional() or self.is_one_of()
+
         def spawn(self):
             if (
                 self.is_primitive()
@@ -67,6 +140,59 @@ def create_encoder(schema):
             ):
                 return []
 
+            next_branches = []
+            for next_type, next_source, grouped in self.next_sources():
+                if not grouped:
+                    next_branches.append(Writer(next_type, next_source))
+                    continue
+                if dedup and self.is_array() and is_shareable(next_type):
+                    writers, self.slots = share_subtrees(
+                        next_type, next_source)
+                else:
+                    writers = [Writer(next_type, source)
+                               for source in next_source]
+                next_branches.append(WriterGroup(writers) if len(
+                    writers) > 1 else writers[0])
+
+            self.branches = next_branches
+            return next_branches
+
+        def refill(self, source):
+            # gives the writers planned for an earlier value the columns of
+            # a new one, False as soon as a column length differs
+            if len(source) != len(self.current_source):
+                return False
+            self.current_source = source
+            self.bitmask = None
+            self.tape_offsets = None
+            self.key_tables = None
+            if "ref" in self.current_type:
+                for i, value in enumerate(source):
+                    references[id(value)] = (self, i)
+            if (
+                self.is_primitive()
+                or self.is_ref()
+                or self.is_link()
+                or self.is_null()
+            ):
+                return True
+
+            for branch, (_, next_source, grouped) in zip(self.branches, self.next_sources()):
+                if not grouped:
+                    if not branch.refill(next_source):
+                        return False
+                    continue
+                writers = as_leaves(branch)
+                if len(writers) != len(next_source):
+                    return False
+                for writer, source in zip(writers, next_source):
+                    if not writer.refill(source):
+                        return False
+            return True
+
+        def next_sources(self):
+            # (type, source, grouped) of each branch, a grouped branch has
+            # a writer per source in a list of them
             current_type = self.current_type
             current_source = self.current_source
 
@@ -75,35 +201,36 @@ def create_encoder(schema):
                 current_source = [transform(source)
                                   for source in current_source]
 
+            if current_type.get("packed"):
+                # rows are written as a whole, there are no child columns
+                self.current_source = current_source
+                return []
+
             if self.is_tuple():
                 children = current_type["children"]
-                next_branches = [Writer(next_type, [
-                                        value[i] for value in current_source]) for i, next_type in enumerate(children)]
+                return [(next_type, [value[i] for value in current_source], False)
+                        for i, next_type in enumerate(children)]
 
             elif self.is_named_tuple():
                 children = current_type["children"]
-                keys = current_type["keys"]
-                next_branches = [Writer(next_type, [
-                                        value.get(key) for value in current_source]) for key, next_type in zip(keys, children)]
+                return [(next_type, column, False) for next_type, column in zip(
+                    children, field_columns(current_type, current_source))]
 
             elif self.is_array():
-                next_type = current_type["children"][0]
-                writers = [Writer(next_type, next_source)
-                           for next_source in current_source]
-                next_branches = [WriterGroup(writers)] if len(
-                    writers) > 1 else writers
+                return [(current_type["children"][0], current_source, True)]
 
             elif self.is_map():
                 next_type = current_type["children"][0]
-                key_writers = [Writer("String", list(value.keys()))
-                               for value in current_source]
-                val_writers = [Writer(next_type, list(value.values()))
-                               for value in current_source]
-                next_branches = [
-                    WriterGroup(key_writers) if len(
-                        key_writers) > 1 else key_writers[0],
-                    WriterGroup(val_writers) if len(
-                        val_writers) > 1 else val_writers[0]
+                key_index = current_type.get("key_index")
+                if key_index == "sorted":
+                    current_source = [dict(sorted(value.items(), key=lambda item: item[0]))
+                                      for value in current_source]
+                if key_index == "hash":
+                    self.key_tables = [encode_hash_table([serialize_string(key) for key in value])
+                                       for value in current_source]
+                return [
+                    ("String", [list(value.keys()) for value in current_source], True),
+                    (next_type, [list(value.values()) for value in current_source], True)
                 ]
 
             elif self.is_optional():
@@ -114,33 +241,45 @@ def create_encoder(schema):
                 self.bitmask = bitmask
                 next_source = [current_source[i]
                                for i in backward_map_indexes(bitmask)]
-                next_branches = [Writer(next_type, next_source)]
+                return [(next_type, next_source, False)]
 
             elif self.is_one_of():
                 children = current_type["children"]
 
+                checkers = [schema[child].get("check", lambda v: True)
+                            for child in children]
+
                 def discriminate(value):
-                    for k in range(len(children)):
-                        next_type = schema[children[k]]
-                        checker = next_type.get("check", lambda v: True)
+                    for k, checker in enumerate(checkers):
                         if checker(value):
                             return k
                     raise ValueError(
                         f'Value {value} does not match any of the OneOf types'
                     )
-                discriminator = [discriminate(value)
-                                 for value in current_source]
+                if trusted and all(checker in TYPE_CHECKS for checker in checkers):
+                    # values of the same type take the branch of the first
+                    # one seen, checks only run once per type. Any other
+                    # check may look at the contents and runs on every value
+                    discriminator = []
+                    for value in current_source:
+                        key = (self.type_name, type(value))
+                        k = dispatches.get(key)
+                        if k is None:
+                            k = discriminate(value)
+                            dispatches.put(key, k)
+                        discriminator.append(k)
+                else:
+                    discriminator = [discriminate(value)
+                                     for value in current_source]
                 one_of_index = one_of_to_index(discriminator, len(children))
                 self.bitmask = one_of_index
                 backward_indexes = backward_map_one_of(
                     one_of_index, len(children))
-                next_branches = [
-                    Writer(next_type, [current_source[i] for i in indexes])
+                return [
+                    (next_type, [current_source[i] for i in indexes], False)
                     for next_type, indexes in zip(children, backward_indexes)
                 ]
-
-            self.branches = next_branches
-            return next_branches
+            return []
 
         def allocate(self, alloc, db):
             if self.is_null():
@@ -158,12 +297,36 @@ def create_encoder(schema):
 
             if self.is_primitive():
                 size = current_type["size"]
-                if callable(size):
+                serialize = current_type.get("serialize")
+                compression = current_type.get("compression")
+                if compression:
+                    # compressed columns live on the data tape and take no
+                    # space in the index region
+                    raw = bytearray(size * len(current_source))
+                    self.write_values(raw, 0, db, 0)
+                    db.put(compress(compression, raw, size,
+                           item_width(current_type)), id(self))
+                    tape_writers.append(self)
+                elif callable(size) and serialize:
+                    if self.tape_offsets is None:
+                        self.tape_offsets = db.put_column(current_source, serialize)
+                    alloc.index_size += len(current_source)
+                elif callable(size):
                     for value in current_source:
                         size(value, db)
                     alloc.index_size += len(current_source)
                 else:
                     alloc.unit_size += size * len(current_source)
+                if current_type.get("indexed"):
+                    # sorted permutation of the column for binary search
+                    permutation = sorted(
+                        range(len(current_source)), key=current_source.__getitem__)
+                    key = (INDEX_SECTION, id(self))
+                    db.put(struct.pack(
+                        f"<{len(permutation)}I", *permutation), key)
+                    sections.append((INDEX_SECTION, self, key))
+            elif current_type.get("packed"):
+                alloc.unit_size += current_type["size"] * len(current_source)
             elif self.is_tuple() or self.is_named_tuple():
                 children = current_type["children"]
                 alloc.index_size += len(children)
@@ -173,23 +336,49 @@ def create_encoder(schema):
             elif self.is_map():
                 alloc.index_size += 2 * len(current_source)
                 alloc.length_size += len(current_source)
+                if self.key_tables is not None:
+                    for table in self.key_tables:
+                        db.put(table, id(table))
+                    alloc.index_size += len(current_source)
             elif self.is_ref():
                 alloc.index_size += len(current_source)
                 alloc.length_size += len(current_source)
             elif self.is_link():
                 alloc.unit_size += 8 * len(current_source)
             elif self.is_optional():
-                db.put(encode_bitmask(bitmask, len(current_source)), id(bitmask))
+                layout = current_type.get("bitmask")
+                if layout:
+                    db.put(encode_discriminator(
+                        list(index_to_bit(bitmask)), 2, layout, True), id(bitmask))
+                else:
+                    db.put(encode_bitmask(bitmask, len(current_source)), id(bitmask))
                 alloc.index_size += 2
             elif self.is_one_of():
                 children = current_type["children"]
-                db.put(encode_one_of(bitmask, len(
-                    current_source), len(children)), id(bitmask))
+                layout = current_type.get("bitmask")
+                if layout:
+                    db.put(encode_discriminator(
+                        list(index_to_one_of(bitmask, len(children))),
+                        len(children), layout), id(bitmask))
+                else:
+                    db.put(encode_one_of(bitmask, len(
+                        current_source), len(children)), id(bitmask))
                 alloc.index_size += len(children) + 1
             else:
                 raise TypeError(
                     f"Allocation not implemented for {current_type['type']}")
 
+            block_size = current_type.get("stats")
+            if block_size:
+                # zone maps are keyed by the value column, which is the
+                # child column for Optional
+                column = self.branches[0] if self.is_optional() else self
+                if not column.is_null():
+                    key = (STATS_SECTION, id(self))
+                    db.put(encode_zone_map(self.type_name,
+                           current_source, block_size), key)
+                    sections.append((STATS_SECTION, column, key))
+
         def position(self, n, m, adj):
             alloc = self.allocated
             self.current_offset = alloc.index_size * n + \
@@ -205,75 +394,85 @@ def create_encoder(schema):
             bitmask = self.bitmask
 
             if self.is_primitive():
-                _size, encode = current_type["size"], current_type["encode"]
-                size = _size if type(_size) == int else index_size
-                for i, value in enumerate(current_source):
-                    offset = current_offset + i * size
-                    encode(dataView, offset, value, db)
+                if not current_type.get("compression"):
+                    self.write_values(dataView, current_offset, db, index_size)
+
+            elif current_type.get("packed"):
+                row = current_type["row"]
+                counts = [count for _, count in current_type["fields"]]
+                columns = field_columns(current_type, current_source)
+                for i, values in enumerate(zip(*columns)):
+                    flat = []
+                    for value, count in zip(values, counts):
+                        if count > 1:
+                            flat.extend(value)
+                        else:
+                            flat.append(value)
+                    row.pack_into(dataView, current_offset + i * row.size, *flat)
 
             elif self.is_tuple() or self.is_named_tuple():
                 for i, branch in enumerate(branches):
                     offset = current_offset + i * index_size
-                    write_varint(dataView, offset, branch.current_offset, True)
+                    write_index(dataView, offset, branch.current_offset, index_size)
 
             elif self.is_array():
-                val_writer_group = branches[0]
-                if isinstance(val_writer_group, WriterGroup):
-                    for i, child in enumerate(val_writer_group.writers):
-                        offset = current_offset + i * \
-                            (index_size + length_size)
-                        write_varint(dataView, offset,
-                                     child.current_offset, True)
-                        write_varint(dataView, offset + index_size,
-                                     len(child.current_source))
-                else:
-                    offset = current_offset
-                    child = val_writer_group
-                    write_varint(dataView, offset, child.current_offset, True)
-                    write_varint(dataView, offset + index_size,
-                                 len(child.current_source))
+                children = self.slots
+                if children is None:
+                    children = as_leaves(branches[0])
+                for i, child in enumerate(children):
+                    offset = current_offset + i * (index_size + length_size)
+                    write_index(dataView, offset,
+                                child.current_offset, index_size)
+                    write_length(dataView, offset + index_size,
+                                 len(child.current_source), length_size)
 
             elif self.is_map():
                 key_writer_group, val_writer_group = branches
+                stride = 2 * index_size + length_size
+                if self.key_tables is not None:
+                    stride += index_size
+                    for i, table in enumerate(self.key_tables):
+                        offset = current_offset + i * stride + \
+                            2 * index_size + length_size
+                        Data_Tape.write(dataView, offset, id(table), db)
+
                 if isinstance(key_writer_group, WriterGroup):
                     for i, child in enumerate(key_writer_group.writers):
-                        offset = current_offset + i * \
-                            (2 * index_size + length_size)
-                        write_varint(dataView, offset,
-                                     child.current_offset, True)
+                        offset = current_offset + i * stride
+                        write_index(dataView, offset,
+                                    child.current_offset, index_size)
                 else:
                     offset = current_offset
                     child = key_writer_group
-                    write_varint(dataView, offset, child.current_offset, True)
+                    write_index(dataView, offset, child.current_offset, index_size)
 
                 if isinstance(val_writer_group, WriterGroup):
                     for i, child in enumerate(val_writer_group.writers):
-                        offset = current_offset + i * \
-                            (2 * index_size + length_size)
-                        write_varint(dataView, offset + index_size,
-                                     child.current_offset, True)
-                        write_varint(dataView, offset + 2 * index_size,
-                                     len(child.current_source))
+                        offset = current_offset + i * stride
+                        write_index(dataView, offset + index_size,
+                                    child.current_offset, index_size)
+                        write_length(dataView, offset + 2 * index_size,
+                                     len(child.current_source), length_size)
                 else:
                     offset = current_offset
                     child = val_writer_group
-                    write_varint(dataView, offset + index_size,
-                                 child.current_offset, True)
-                    write_varint(dataView, offset + 2 * index_size,
-                                 len(child.current_source))
+                    write_index(dataView, offset + index_size,
+                                child.current_offset, index_size)
+                    write_length(dataView, offset + 2 * index_size,
+                                 len(child.current_source), length_size)
 
             elif self.is_optional():
                 val_writer = branches[0]
                 Data_Tape.write(dataView, current_offset, id(bitmask), db)
-                write_varint(dataView, current_offset +
-                             index_size, val_writer.current_offset, True)
+                write_index(dataView, current_offset +
+                            index_size, val_writer.current_offset, index_size)
 
             elif self.is_one_of():
                 Data_Tape.write(dataView, current_offset, id(bitmask), db)
                 for i, val_writer in enumerate(branches):
                     offset = current_offset + index_size * (i + 1)
-                    write_varint(dataView, offset,
-                                 val_writer.current_offset, True)
+                    write_index(dataView, offset,
+                                val_writer.current_offset, index_size)
 
             elif self.is_ref():
                 for i, value in enumerate(current_source):
@@ -282,14 +481,33 @@ def create_encoder(schema):
                         raise ValueError("Reference object outside of scope")
                     writer, index = ref
                     offset = current_offset + i * (index_size + length_size)
-                    write_varint(dataView, offset, writer.current_offset, True)
-                    write_varint(dataView, offset + index_size, index, True)
+                    write_index(dataView, offset, writer.current_offset, index_size)
+                    write_length(dataView, offset + index_size, index, length_size)
 
             elif self.is_link():
-                for i, _ in enumerate(current_source):
+                link = current_type["children"][0]
+                for i, value in enumerate(current_source):
                     offset = current_offset + i * 8
-                    encode_int32(dataView, offset, -1)
-                    encode_int32(dataView, offset + 4, -1)
+                    next_offset, next_index = resolve_link(value, link)
+                    encode_int32(dataView, offset, next_offset)
+                    encode_int32(dataView, offset + 4, next_index)
+
+        def write_values(self, dataView, current_offset, db, index_size):
+            current_type = self.current_type
+            current_source = self.current_source
+            _size, encode = current_type["size"], current_type["encode"]
+            encode_column = current_type.get("encode_column")
+            if encode_column:
+                encode_column(dataView, current_offset, current_source)
+                return
+            if self.tape_offsets is not None:
+                Data_Tape.write_column(
+                    dataView, current_offset, self.tape_offsets, db, index_size)
+                return
+            size = _size if type(_size) == int else index_size
+            for i, value in enumerate(current_source):
+                offset = current_offset + i * size
+                encode(dataView, offset, value, db)
 
     class WriterGroup(Writer):
         def __init__(self, writers):
@@ -326,82 +544,461 @@ def create_encoder(schema):
             for writer in self.writers:
                 writer.write(dataView, db, index_size, length_size)
 
-    references = {}
+    def is_shareable(type_name):
+        if type_name not in shareable:
+            shareable[type_name] = not holds_ref_targets(schema, type_name)
+        return shareable[type_name]
+
+    def share_subtrees(type_name, values):
+        # identical arrays are spawned once, the slots of every copy point
+        # at the same child writer
+        writers = []
+        slots = []
+        for value in values:
+            try:
+                key = (type_name, fingerprint(value))
+            except TypeError:
+                key = None
+            writer = subtrees.get(key) if key is not None else None
+            if writer is None:
+                writer = Writer(type_name, value)
+                writers.append(writer)
+                if key is not None:
+                    subtrees[key] = writer
+            slots.append(writer)
+        return writers, slots
 
-    def encode(data, root_type):
+    references = {}
+    tape_writers = []
+    sections = []
+    subtrees = {}
+    shareable = {}
+    plans = LRUCache(plan_cache_size) if plan_cache_size else None
+    # OneOf branch per value type in trusted mode
+    dispatches = LRUCache(1024)
+
+    def encode(data, root_type, plans=plans, report=None):
+        return encode_value(data, root_type, plans, report)
+
+    def encode_value(data, root_type, plans, report=None, db=None):
+        # db is a tape shared by consecutive values, cleared for each one
+        if validate:
+            validate_data(schema, data, root_type)
         references.clear()
-        grouped_writers = {}
-        stack = []
-        root = Writer(root_type, [data])
-        stack.append(root)
+        subtrees.clear()
+        if db is None:
+            db = Data_Tape(hash_threshold)
+        else:
+            db.clear()
+        if plans is not None:
+            plan = plans.get((root_type, shape_key(data)))
+            if plan is not None:
+                encoded = replay(plan, data, db)
+                if encoded is not None:
+                    return encoded
+                db.clear()
+        return assemble(Writer(root_type, [data]), root_type, plans, report, db)
+
+    def assemble(root, root_type, plans=None, report=None, db=None):
+        tape_writers.clear()
+        sections.clear()
+        ordered = []
+        stack = [root]
 
         while stack:
             writer = stack.pop()
-            type_name = writer.type_name
-            grouped_writers[type_name] = grouped_writers.get(type_name, [])
-            grouped_writers[type_name].append(writer)
+            ordered.append(writer)
             children = writer.spawn()
             for i in range(len(children) - 1, -1, -1):
                 stack.append(children[i])
 
-        def sort_key(writers):
-            writer_type = writers[0].current_type
-            size = writer_type.get("size", None)
-            return size if type(size) == int else 0
-        sorted_writers = sorted(grouped_writers.values(),
-                                key=sort_key)
+        sorted_writers = group_writers(ordered)
+        allocation_order = [
+            writer for writers in sorted_writers for writer in writers]
+        paddings = set()
+        for writers in sorted_writers:
+            align = alignment_of(writers[0].current_type)
+            if align is not None:
+                paddings.add(align - 1)
 
         alloc = SimpleNamespace(index_size=0, length_size=0,
                                 unit_size=1, max_length=0)
-        db = Data_Tape()
+        if db is None:
+            db = Data_Tape(hash_threshold)
 
-        for writers in sorted_writers:
-            for writer in writers:
+        for writer in allocation_order:
+            if report is None:
                 writer.allocate(alloc, db)
-
-        paddings = set()
-        for writers in sorted_writers:
-            writer_type = writers[0].current_type
-            if type(writer_type.get("size", None)) == int:
-                paddings.add(writer_type["size"] - 1)
+                continue
+            before = (alloc.index_size, alloc.length_size,
+                      alloc.unit_size, db.offset)
+            writer.allocate(alloc, db)
+            record_allocation(report, writer, alloc, db, before)
+
+        directory = None
+        trailer_size = 0
+        if sections:
+            directory = create_directory(len(sections))
+            db.put(directory, id(directory))
+            trailer_size = TRAILER.size
 
         exported_db = db.export()
-        n, m = optimizeAlloc(alloc, paddings, len(exported_db))
+        n, m = optimizeAlloc(alloc, paddings, db.offset +
+                             db.alignment - 1 + trailer_size, fixed_width)
 
         sum_padding = 0
         for writers in sorted_writers:
-            writer_type = writers[0].current_type
-            if type(writer_type.get("size", None)) == int:
+            align = alignment_of(writers[0].current_type)
+            if align is not None:
                 _alloc = writers[0].allocated
                 _offset = _alloc.index_size * n + _alloc.length_size * \
                     m + _alloc.unit_size + sum_padding
-                if _offset % writer_type["size"] != 0:
-                    sum_padding += writer_type["size"] - \
-                        (_offset % writer_type["size"])
+                if _offset % align != 0:
+                    padding = align - (_offset % align)
+                    sum_padding += padding
+                    if report is not None:
+                        report.paths[writers[0].type_name].padding += padding
             for writer in writers:
                 writer.position(n, m, sum_padding)
 
-        offset = alloc.index_size * n + alloc.length_size * \
+        header = (n << 4) | m | (FIXED_WIDTH if fixed_width else 0)
+        region_size = alloc.index_size * n + alloc.length_size * \
             m + alloc.unit_size + sum_padding
-        buffer = bytearray(offset)
+        offset = region_size + (-region_size % db.alignment)
         db.shift(offset)
+        for writer in tape_writers:
+            writer.current_offset = db.get(id(writer))
+        if directory is not None:
+            fill_directory(directory, sections, db)
+            exported_db = [*exported_db,
+                           encode_trailer(db.get(id(directory)), directory)]
+
+        if plans is not None and not dedup:
+            # structural slots depend on the shape only, a value of the same
+            # shape refills these writers and rewrites the rest over the
+            # template
+            template = bytearray(region_size)
+            dynamic = []
+            for writer in allocation_order:
+                if writer.is_structural():
+                    writer.write(template, db, n, m)
+                else:
+                    dynamic.append(writer)
+            plans.put((root_type, shape_key(root.current_source[0])), SimpleNamespace(
+                root=root,
+                dynamic=dynamic,
+                taped=[writer for writer in dynamic if writer.uses_tape()],
+                tape_range=tape_range(alloc, paddings, n, m, fixed_width),
+                n=n,
+                m=m,
+                region_size=region_size,
+                template=bytes(template)
+            ))
 
-        buffer[0] = (n << 4) | m
-        for writers in sorted_writers:
-            for writer in writers:
-                writer.write(buffer, db, n, m)
+        buffer = bytearray(offset)
+        buffer[0] = header
+        for writer in allocation_order:
+            writer.write(buffer, db, n, m)
+
+        if report is not None:
+            report.n, report.m = n, m
+            report.region_size = offset
+        return b"".join([buffer, *exported_db])
+
+    def replay(plan, data, db):
+        # None when data does not have the shape of the plan after all or
+        # its tape does not fit the planned slot sizes
+        tape_writers.clear()
+        sections.clear()
+        if not plan.root.refill([data]):
+            return None
+
+        unplanned = SimpleNamespace(index_size=0, length_size=0,
+                                    unit_size=0, max_length=0)
+        for writer in plan.taped:
+            writer.allocate(unplanned, db)
+
+        directory = None
+        trailer_size = 0
+        if sections:
+            directory = create_directory(len(sections))
+            db.put(directory, id(directory))
+            trailer_size = TRAILER.size
+
+        if db.offset + db.alignment - 1 + trailer_size not in plan.tape_range:
+            return None
+        exported_db = db.export()
+        n, m = plan.n, plan.m
 
-        return bytes(buffer + exported_db)
+        region_size = plan.region_size
+        offset = region_size + (-region_size % db.alignment)
+        db.shift(offset)
+        for writer in tape_writers:
+            writer.current_offset = db.get(id(writer))
+        if directory is not None:
+            fill_directory(directory, sections, db)
+            exported_db = [*exported_db,
+                           encode_trailer(db.get(id(directory)), directory)]
+
+        buffer = bytearray(plan.template)
+        buffer.extend(bytes(offset - region_size))
+        buffer[0] = (n << 4) | m | (FIXED_WIDTH if fixed_width else 0)
+        for writer in plan.dynamic:
+            writer.write(buffer, db, n, m)
+        return b"".join([buffer, *exported_db])
+
+    def encode_many(records, root_type, concat=False):
+        """Encodes each record into its own container. Records of the same
+        shape share a layout plan even when the encoder has no plan cache.
+        With concat=True returns one buffer and the array of container
+        offsets into it (with the total length last)."""
+        batch_plans = plans if plans is not None else LRUCache(8)
+        db = Data_Tape(hash_threshold)
+        encoded = [encode_value(record, root_type, batch_plans, db=db)
+                   for record in records]
+        if not concat:
+            return encoded
+        offsets = array('q', [0])
+        for container in encoded:
+            offsets.append(offsets[-1] + len(container))
+        return b"".join(encoded), offsets
+
+    class BuiltWriter(Writer):
+        # branches are built from the columns of a Builder, there is no
+        # source left to spawn them from
+        def __init__(self, type_name, source, branches=()):
+            super().__init__(type_name, source)
+            self.branches = list(branches)
 
+        def spawn(self):
+            return [] if self.is_null() else self.branches
+
+    def as_branch(writers):
+        return [WriterGroup(writers)] if len(writers) > 1 else writers
+
+    def build_writer(column, start, end):
+        # the writer spawn would create for rows start to end of a column
+        type_name = column.type_name
+        if column.kind == "Primitive":
+            writer = BuiltWriter(type_name, column.source(start, end))
+            if column.tape_offsets is not None:
+                writer.tape_offsets = column.tape_offsets[start:end]
+            return writer
+        if column.packed:
+            return BuiltWriter(type_name, column.packed_rows(start, end))
+
+        source = range(end - start)
+        bitmask = None
+        key_tables = None
+        if column.kind in ("Tuple", "NamedTuple"):
+            branches = [build_writer(child, start, end) for child in column.children]
+        elif column.kind == "Array":
+            offsets = column.offsets
+            branches = as_branch([build_writer(column.child, offsets[i], offsets[i + 1])
+                                  for i in range(start, end)])
+        elif column.kind == "Map":
+            offsets = column.offsets
+            branches = [
+                *as_branch([build_writer(column.keys, offsets[i], offsets[i + 1])
+                            for i in range(start, end)]),
+                *as_branch([build_writer(column.child, offsets[i], offsets[i + 1])
+                            for i in range(start, end)]),
+            ]
+            if column.record.get("key_index") == "hash":
+                keys = column.keys.values
+                key_tables = [encode_hash_table([serialize_string(key)
+                                                 for key in keys[offsets[i]:offsets[i + 1]]])
+                              for i in range(start, end)]
+        elif column.kind == "Optional":
+            bitmask = bit_to_index(column.bits[start:end])
+            present = column.present
+            branches = [build_writer(column.child, present[start], present[end])]
+        else:
+            bitmask = one_of_to_index(
+                column.discriminator[start:end], len(column.children))
+            branches = [build_writer(child, prefix[start], prefix[end])
+                        for child, prefix in zip(column.children, column.prefix)]
+
+        writer = BuiltWriter(type_name, source, branches)
+        writer.bitmask = bitmask
+        writer.key_tables = key_tables
+        return writer
+
+    def build_root(builder, type_name, path, nested):
+        column = builder.arrays.get(path)
+        if column is not None:
+            return BuiltWriter(type_name, [None], [build_writer(column, 0, column.count)])
+        if path in builder.values:
+            return Writer(type_name, [builder.values[path]])
+        record = schema[type_name]
+        if path in nested:
+            keys = record.get("keys") or range(len(record["children"]))
+            return BuiltWriter(type_name, [None], [
+                build_root(builder, child, (*path, key), nested)
+                for key, child in zip(keys, record["children"])
+            ])
+        defaults = {"Array": [], "Map": {}, "Optional": None}
+        if record["type"] not in defaults:
+            raise ValueError(
+                f'{".".join(map(str, path)) or type_name} was neither appended to nor set')
+        return Writer(type_name, [defaults[record["type"]]])
+
+    def finish(builder):
+        references.clear()
+        subtrees.clear()
+        nested = {path[:i] for path in (*builder.arrays, *builder.values)
+                  for i in range(len(path))}
+        root = build_root(builder, builder.root_type, (), nested)
+        return assemble(root, builder.root_type, db=builder.db)
+
+    def builder(root_type):
+        """Appendable container, see Builder"""
+        return Builder(schema, root_type, Data_Tape(hash_threshold), finish,
+                       validate_data if validate else None)
+
+    encode.encode_many = encode_many
+    encode.builder = builder
     return encode
 
 
-def optimizeAlloc(alloc, paddings, additional):
+def record_allocation(report, writer, alloc, db, before):
+    # slots and bytes a writer added, slot widths are only known once the
+    # whole layout is planned
+    index_size, length_size, unit_size, tape_offset = before
+    entry = report.paths.get(writer.type_name)
+    if entry is None:
+        entry = report.paths[writer.type_name] = SimpleNamespace(
+            kind=writer.current_type["type"], values=0, index_slots=0,
+            length_slots=0, payload=0, padding=0, tape=0, writers=[])
+    leaves = as_leaves(writer)
+    entry.values += sum(len(leaf.current_source) for leaf in leaves)
+    entry.index_slots += alloc.index_size - index_size
+    entry.length_slots += alloc.length_size - length_size
+    entry.payload += alloc.unit_size - unit_size
+    entry.tape += db.offset - tape_offset
+    entry.writers.extend(leaves)
+
+
+def as_leaves(writer):
+    return writer.writers if hasattr(writer, "writers") else [writer]
+
+
+def shape_key(value):
+    if isinstance(value, (list, tuple)):
+        return (type(value), len(value))
+    if isinstance(value, dict):
+        return (dict, tuple(value))
+    return type(value)
+
+
+def fingerprint(value):
+    # exact, hashable image of a source value, floats by their bits so that
+    # -0.0 and NaN payloads are kept apart
+    if isinstance(value, dict):
+        return ("dict", tuple((key, fingerprint(v)) for key, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return ("list", tuple(fingerprint(v) for v in value))
+    if isinstance(value, float):
+        return ("float", value.hex())
+    if value is None or isinstance(value, (str, int)):
+        return (type(value).__name__, value)
+    if hasattr(value, "tolist"):
+        return fingerprint(value.tolist())
+    return ("bytes", bytes(memoryview(value)))
+
+
+def holds_ref_targets(schema, type_name, visited=None):
+    # values referenced by a Ref are located by identity, their subtrees
+    # are never shared
+    visited = set() if visited is None else visited
+    if type_name in visited:
+        return False
+    visited.add(type_name)
+    record = schema[type_name]
+    if record.get("ref"):
+        return True
+    if record["type"] in ("Ref", "Link"):
+        return False
+    return any(holds_ref_targets(schema, child, visited)
+               for child in record.get("children", []))
+
+
+def group_writers(ordered):
+    grouped_writers = {}
+    for writer in ordered:
+        grouped_writers.setdefault(writer.type_name, []).append(writer)
+
+    def sort_key(writers):
+        writer_type = writers[0].current_type
+        size = writer_type.get("size", None)
+        return size if type(size) == int else 0
+    return sorted(grouped_writers.values(), key=sort_key)
+
+
+def alignment_of(writer_type):
+    # fixed size columns start at a multiple of their size, packed rows only
+    # need their widest field aligned
+    size = writer_type.get("size", None)
+    if type(size) != int:
+        return None
+    return writer_type.get("align", size)
+
+
+def resolve_link(value, link):
+    # a link is either None, an (offset, index) pair or a single value reader
+    # pointing into the linked container
+    if value is None:
+        return -1, -1
+    if isinstance(value, tuple):
+        return value
+    _, type_name = link.split("/", 1)
+    if value.type_name != type_name:
+        raise ValueError(
+            f"Link to {link} cannot point at a value of type {value.type_name}")
+    if not value.single_value():
+        raise ValueError("Link should point at a single value")
+    if value.is_undefined():
+        return -1, -1
+    return value.current_offset, value.current_index
+
+
+# slot widths that map onto plain integer types, length slots stop at 4
+# bytes since the header keeps 3 bits for them in fixed width mode
+FIXED_INDEX_SIZES = (1, 2, 4, 8)
+FIXED_LENGTH_SIZES = (1, 2, 4)
+
+
+def tape_range(alloc, paddings, n, m, fixed_width=False):
+    """Additional sizes for which optimizeAlloc(alloc, paddings, additional)
+    returns [n, m]: the total fits n byte index slots and no smaller ones"""
+    sizes = FIXED_INDEX_SIZES if fixed_width else range(1, 9)
+    sum_padding = sum(paddings)
+
+    def room(n):
+        # padded zigzag varints, up to 2 ** (7 * n - 1) - 1
+        used = alloc.index_size * n + alloc.length_size * m + alloc.unit_size + sum_padding
+        return (1 << (7 * n - 1)) - used
+
+    return range(max((room(k) for k in sizes if k < n), default=0), room(n))
+
+
+def optimizeAlloc(alloc, paddings, additional, fixed_width=False):
+    # index slots go up to 8 bytes (55 bit offsets as padded zigzag
+    # varints), enough to address containers far beyond 4 GB
     m = size_varint(alloc.max_length)
+    sizes = range(1, 9)
+    if fixed_width:
+        m = next((m for m in FIXED_LENGTH_SIZES if alloc.max_length < 1 << (8 * m)), None)
+        if m is None:
+            raise IndexError("Length overflow, split data into smaller chunks")
+        sizes = FIXED_INDEX_SIZES
     sum_padding = sum(paddings)
-    for n in range(1, 5):
+    for n in sizes:
         total_size = alloc.index_size * n + alloc.length_size * \
             m + alloc.unit_size + sum_padding + additional
+        # tape pointers (strings, bytes, bitmasks, key tables) stay padded
+        # zigzag varints in fixed width mode, they hold fewer bits than the
+        # signed little endian index slots
         if size_varint(total_size, True) <= n:
             return [n, m]
     raise IndexError("Index overflow, split data into smaller chunks")
@@ -0,0 +1,44 @@
+from bisect import bisect_right
+
+
+def _mean(values):
+    return sum(values) / len(values) if len(values) else None
+
+
+AGGREGATES = {
+    "count": len,
+    "sum": sum,
+    "min": lambda values: min(values) if len(values) else None,
+    "max": lambda values: max(values) if len(values) else None,
+    "mean": _mean,
+}
+
+
+def aggregate(values, op):
+    reduce = AGGREGATES.get(op)
+    if reduce is None:
+        raise ValueError(
+            f'Unknown aggregate {op}. Use one of {", ".join(AGGREGATES)}')
+    return reduce(values)
+
+
+def histogram(values, edges):
+    """Counts of values per bin [edges[k], edges[k + 1]), values outside the
+    edges are left out"""
+    counts = [0] * (len(edges) - 1)
+    for value in values:
+        k = bisect_right(edges, value) - 1
+        if 0 <= k < len(counts):
+            counts[k] += 1
+        elif value == edges[-1]:
+            counts[-1] += 1
+    return counts
+
+
+def group_by(keys, values, op):
+    groups = {}
+    for key, value in zip(keys, values):
+        if key is None or value is None:
+            continue
+        groups.setdefault(key, []).append(value)
+    return {key: aggregate(group, op) for key, group in groups.items()}
@@ -1,30 +1,91 @@
+from array import array
+from functools import partial
+
+
+class Memoized:
+    """Index sequence computed at most once. Values are pulled from the
+    generator on demand and kept in an array, so a sequence shared by several
+    consumers (or iterated again) reads the array instead of recomputing the
+    chain. Supports len() and indexing/slicing, which materialize it fully."""
+
+    def __init__(self, generate):
+        self._source = generate()
+        self._values = array('q')
+
+    def __iter__(self):
+        if self._source is None:
+            return iter(self._values)
+        return self._iterate()
+
+    def _iterate(self):
+        values = self._values
+        i = 0
+        while True:
+            if i < len(values):
+                yield values[i]
+                i += 1
+            elif self._source is None:
+                return
+            else:
+                value = next(self._source, None)
+                if value is None:
+                    self._source = None
+                    return
+                values.append(value)
+
+    @classmethod
+    def of(cls, values):
+        """Wrap an already computed index array."""
+        memoized = cls.__new__(cls)
+        memoized._source = None
+        memoized._values = values
+        return memoized
+
+    def materialize(self):
+        if self._source is not None:
+            self._values.extend(self._source)
+            self._source = None
+        return self._values
+
+    def __len__(self):
+        return len(self.materialize())
+
+    def __getitem__(self, key):
+        return self.materialize()[key]
+
+
+def _values_of(indexes):
+    if isinstance(indexes, Memoized):
+        return indexes.materialize()
+    return indexes if isinstance(indexes, (array, list)) else list(indexes)
+
+
 def decode_bitmask(encoded, max_index):
-    class Iter:
-        def __iter__(self):
-            n = max_index + 1
-            depth = (n - 1).bit_length()
-            reader = read_bit(encoded)
-            stack = []
-            stack.append(depth)
-
-            curr_index = 0
-
-            while stack:
-                if curr_index >= n:
-                    break
-
-                next_value = reader()
-                level = stack.pop()
-
-                if level == 0:
-                    if next_value:
-                        yield curr_index
-                    curr_index += 1
-                elif next_value:
-                    stack.extend([level - 1, level - 1])
-                else:
-                    curr_index += 1 << level
-    return Iter()
+    def generate():
+        n = max_index + 1
+        depth = (n - 1).bit_length()
+        reader = read_bit(encoded)
+        stack = []
+        stack.append(depth)
+
+        curr_index = 0
+
+        while stack:
+            if curr_index >= n:
+                break
+
+            next_value = reader()
+            level = stack.pop()
+
+            if level == 0:
+                if next_value:
+                    yield curr_index
+                curr_index += 1
+            elif next_value:
+                stack.extend([level - 1, level - 1])
+            else:
+                curr_index += 1 << level
+    return Memoized(generate)
 
 
 def encode_bitmask(iterable, max_index):
@@ -75,96 +136,90 @@ def encode_one_of(iterable, max_index, no_of_class):
 
 
 def bit_to_index(iterable):
-    class Iter:
-        def __iter__(self):
-            index = 0
-            curr = 0
-            for b in iterable:
-                if b != curr:
-                    yield index
-                    curr = b
-                index += 1
-            yield index
-    return Iter()
+    def generate():
+        index = 0
+        curr = 0
+        for b in iterable:
+            if b != curr:
+                yield index
+                curr = b
+            index += 1
+        yield index
+    return Memoized(generate)
 
 
 def one_of_to_index(iterable, no_of_class):
-    class Iter:
-        def __iter__(self):
-            index = 0
-            curr = -1
-            for k in iterable:
-                if k != curr:
-                    if index > 0:
-                        yield index * no_of_class + curr
-                    curr = k
-                index += 1
-            if index > 0:
-                yield index * no_of_class + curr
-    return Iter()
+    def generate():
+        index = 0
+        curr = -1
+        for k in iterable:
+            if k != curr:
+                if index > 0:
+                    yield index * no_of_class + curr
+                curr = k
+            index += 1
+        if index > 0:
+            yield index * no_of_class + curr
+    return Memoized(generate)
 
 
 def index_to_bit(decoded_bitmask):
-    class Iter:
-        def __iter__(self):
-            index = 0
-            curr = 0
-            for i in decoded_bitmask:
-                while index < i:
-                    yield curr
-                    index += 1
-                curr = 1 - curr
-    return Iter()
+    def generate():
+        index = 0
+        curr = 0
+        for i in decoded_bitmask:
+            while index < i:
+                yield curr
+                index += 1
+            curr = 1 - curr
+    return Memoized(generate)
 
 
 def index_to_one_of(decoded_one_of, no_of_class):
-    class Iter:
-        def __iter__(self):
-            index = 0
-            for _i in decoded_one_of:
-                curr = _i % no_of_class
-                i = _i // no_of_class
-                while index < i:
-                    yield curr
-                    index += 1
-    return Iter()
+    def generate():
+        index = 0
+        for _i in decoded_one_of:
+            curr = _i % no_of_class
+            i = _i // no_of_class
+            while index < i:
+                yield curr
+                index += 1
+    return Memoized(generate)
 
 
 def forward_map_indexes(decoded_bitmask, equals=1):
-    class Iter:
-        def __iter__(self):
-            ones = 0
-            index = 0
-            curr = 1 - equals
-
-            for i in decoded_bitmask:
-                if curr:
-                    while index < i:
-                        yield ones
-                        ones += 1
-                        index += 1
-                else:
-                    while index < i:
-                        yield -1
-                        index += 1
-                curr = 1 - curr
-    return Iter()
+    def generate():
+        ones = 0
+        index = 0
+        curr = 1 - equals
+
+        for i in decoded_bitmask:
+            if curr:
+                while index < i:
+                    yield ones
+                    ones += 1
+                    index += 1
+            else:
+                while index < i:
+                    yield -1
+                    index += 1
+            curr = 1 - curr
+    return Memoized(generate)
 
 
 def backward_map_indexes(decoded_bitmask, equals=1):
-    class Iter:
-        def __iter__(self):
-            index = 0
-            curr = 1 - equals
-            for i in decoded_bitmask:
-                if curr:
-                    while index < i:
-                        yield index
-                        index += 1
-                else:
-                    index = i
-                curr = 1 - curr
-    return Iter()
+    def generate():
+        index = 0
+        curr = 1 - equals
+        for i in decoded_bitmask:
+            if curr:
+                while index < i:
+                    yield index
+                    index += 1
+            else:
+                index = i
+            curr = 1 - curr
+    return Memoized(generate)
 
 
 def forward_map_single_index(index, decoded_bitmask, equals=1):
@@ -200,75 +255,61 @@ def backward_map_single_index(index, decoded_bitmask, equals=1):
 
 
 def chain_forward_indexes(curr_mapped, next_mapped):
-    class Iter:
-        def __iter__(self):
-            next_iter = iter(next_mapped)
-            for i in curr_mapped:
-                if i < 0:
-                    yield -1
-                else:
-                    next_value = next(next_iter, None)
-                    yield -1 if next_value is None else next_value
-    return Iter()
+    """Compose two forward maps level by level: the non-negative entries of
+    ``curr_mapped`` count up from 0, so each one indexes ``next_mapped``."""
+    curr_values = _values_of(curr_mapped)
+    next_values = _values_of(next_mapped)
+    size = len(next_values)
+    return Memoized.of(array('q', [
+        next_values[i] if 0 <= i < size else -1 for i in curr_values
+    ]))
 
 
 def chain_backward_indexes(curr_mapped, next_mapped):
-    class Iter:
-        def __iter__(self):
-            curr_iter = iter(curr_mapped)
-            index = 0
-            next_value = next(curr_iter, None)
-
-            for i in next_mapped:
-                while index < i:
-                    next_value = next(curr_iter, None)
-                    index += 1
-                if next_value is None:
-                    return
-                yield next_value
-    return Iter()
+    """Compose two backward maps level by level: every entry of
+    ``next_mapped`` is a position in ``curr_mapped``."""
+    curr_values = _values_of(curr_mapped)
+    size = len(curr_values)
+    composed = array('q')
+    for i in _values_of(next_mapped):
+        if i >= size:
+            break
+        composed.append(curr_values[i])
+    return Memoized.of(composed)
 
 
 def forward_map_one_of(decoded_one_of, no_of_class):
-    class Iter:
-        def __init__(self, k):
-            self.k = k
-
-        def __iter__(self):
-            ones = 0
-            index = 0
-            for _i in decoded_one_of:
-                curr = _i % no_of_class
-                i = _i // no_of_class
-                if curr == self.k:
-                    while index < i:
-                        yield ones
-                        ones += 1
-                        index += 1
-                else:
-                    while index < i:
-                        yield -1
-                        index += 1
-    return [Iter(k) for k in range(no_of_class)]
+    def generate(k):
+        ones = 0
+        index = 0
+        for _i in decoded_one_of:
+            curr = _i % no_of_class
+            i = _i // no_of_class
+            if curr == k:
+                while index < i:
+                    yield ones
+                    ones += 1
+                    index += 1
+            else:
+                while index < i:
+                    yield -1
+                    index += 1
+    return [Memoized(partial(generate, k)) for k in range(no_of_class)]
 
 
 def backward_map_one_of(decoded_one_of, no_of_class):
-    class Iter:
-        def __init__(self, k):
-            self.k = k
-
-        def __iter__(self):
-            index = 0
-            for _i in decoded_one_of:
-                curr = _i % no_of_class
-                i = _i // no_of_class
-                if curr == self.k:
-                    while index < i:
-                        yield index
-                        index += 1
-                else:
-                    index = i
-    return [Iter(k) for k in range(no_of_class)]
+    def generate(k):
+        index = 0
+        for _i in decoded_one_of:
+            curr = _i % no_of_class
+            i = _i // no_of_class
+            if curr == k:
+                while index < i:
+                    yield index
+                    index += 1
+            else:
+                index = i
+    return [Memoized(partial(generate, k)) for k in range(no_of_class)]
 
 
 def forward_map_single_one_of(index, decoded_one_of, no_of_class):
@@ -310,26 +351,25 @@ def backward_map_single_one_of(index, group, decoded_one_of, no_of_class):
 
 
 def diff_indexes(curr_indexes, next_indexes):
-    class Iter:
-        def __iter__(self):
-            next_iter = iter(next_indexes)
-            next_index = next(next_iter, None)
+    def generate():
+        next_iter = iter(next_indexes)
+        next_index = next(next_iter, None)
 
-            for curr_index in curr_indexes:
-                while next_index is not None and next_index < curr_index:
-                    yield next_index
-                    next_index = next(next_iter, None)
-
-                if next_index is None or next_index > curr_index:
-                    yield curr_index
-                else:
-                    next_index = next(next_iter, None)
-
-            while next_index is not None:
+        for curr_index in curr_indexes:
+            while next_index is not None and next_index < curr_index:
                 yield next_index
                 next_index = next(next_iter, None)
 
-    return Iter()
+            if next_index is None or next_index > curr_index:
+                yield curr_index
+            else:
+                next_index = next(next_iter, None)
+
+        while next_index is not None:
+            yield next_index
+            next_index = next(next_iter, None)
+
+    return Memoized(generate)
 
 
 def read_bit(arr):
@@ -0,0 +1,173 @@
+from functools import partial
+
+from .bitmask import (
+    Memoized,
+    encode_bitmask,
+    decode_bitmask,
+    encode_one_of,
+    decode_one_of,
+    bit_to_index,
+    one_of_to_index,
+    index_to_bit,
+    read_bit,
+    write_bit
+)
+from .io import read_varint, write_prefixed_varint
+
+# the first byte of a tagged bitmask is the position of its layout here
+LAYOUTS = ["tree", "dense", "runs", "alt"]
+BITMASK_LAYOUTS = ["adaptive", *LAYOUTS]
+
+
+def one_of_to_index_alt(iterable, no_of_class):
+    def generate(k):
+        index = 0
+        curr = 0
+        for n in iterable:
+            if n >= k:
+                b = 1 if n > k else 0
+                if b != curr:
+                    yield index
+                    curr = b
+                index += 1
+        yield index
+    return [Memoized(partial(generate, k)) for k in range(no_of_class - 1)]
+
+
+def index_to_one_of_alt(decoded_bitmasks, max_index):
+    classes = [len(decoded_bitmasks)] * max_index
+    remaining = range(max_index)
+    for k, decoded_bitmask in enumerate(decoded_bitmasks):
+        ones = []
+        for i, b in zip(remaining, index_to_bit(decoded_bitmask)):
+            if b:
+                ones.append(i)
+            else:
+                classes[i] = k
+        remaining = ones
+    return classes
+
+
+def encode_dense(discriminator, no_of_class):
+    width = (no_of_class - 1).bit_length()
+    output = bytearray()
+    writer = write_bit(output)
+    for k in discriminator:
+        for j in range(width):
+            writer((k >> j) & 1)
+    return bytes(output)
+
+
+def decode_dense(encoded, max_index, no_of_class):
+    width = (no_of_class - 1).bit_length()
+    reader = read_bit(encoded)
+    discriminator = []
+    for _ in range(max_index):
+        k = 0
+        for j in range(width):
+            k |= reader() << j
+        discriminator.append(k)
+    return discriminator
+
+
+def encode_runs(decoded_bitmask):
+    output = bytearray()
+    prev = 0
+    for i in decoded_bitmask:
+        write_prefixed_varint(output, 0, i - prev)
+        prev = i
+    return bytes(output)
+
+
+def decode_runs(encoded):
+    decoded = []
+    offset = 0
+    prev = 0
+    while offset < len(encoded):
+        delta = read_varint(encoded, offset)
+        while encoded[offset] & 128:
+            offset += 1
+        offset += 1
+        prev += delta
+        decoded.append(prev)
+    return decoded
+
+
+def encode_alt(discriminator, no_of_class):
+    output = bytearray()
+    count = len(discriminator)
+    for k, iterable in enumerate(one_of_to_index_alt(discriminator, no_of_class)):
+        encoded = encode_bitmask(iterable, count)
+        write_prefixed_varint(output, 0, len(encoded))
+        output.extend(encoded)
+        count = sum(1 for n in discriminator if n > k)
+    return bytes(output)
+
+
+def decode_alt(encoded, max_index, no_of_class):
+    decoded_bitmasks = []
+    offset = 0
+    count = max_index
+    for _ in range(no_of_class - 1):
+        size = read_varint(encoded, offset)
+        while encoded[offset] & 128:
+            offset += 1
+        offset += 1
+        decoded = list(decode_bitmask(encoded[offset:offset + size], count))
+        offset += size
+        decoded_bitmasks.append(decoded)
+        count = sum(index_to_bit(decoded))
+    return index_to_one_of_alt(decoded_bitmasks, max_index)
+
+
+def encode_discriminator(discriminator, no_of_class, layout, optional=False):
+    """Tagged encoding of an Optional (0/1) or OneOf (class per value)
+    discriminator. The adaptive layout keeps the smallest candidate."""
+    if layout == "adaptive":
+        candidates = ["dense", "runs", "tree"] if optional else LAYOUTS[1:] + ["tree"]
+        return min(
+            (encode_discriminator(discriminator, no_of_class, candidate, optional)
+             for candidate in candidates),
+            key=len
+        )
+
+    max_index = len(discriminator)
+    if optional:
+        decoded = bit_to_index(discriminator)
+    else:
+        decoded = one_of_to_index(discriminator, no_of_class)
+
+    if layout == "tree":
+        encoded = encode_bitmask(decoded, max_index) if optional else \
+            encode_one_of(decoded, max_index, no_of_class)
+    elif layout == "dense":
+        encoded = encode_dense(discriminator, no_of_class)
+    elif layout == "runs":
+        encoded = encode_runs(decoded)
+    elif layout == "alt":
+        encoded = encode_alt(discriminator, no_of_class)
+    else:
+        raise ValueError(f'Unknown bitmask layout {layout}')
+    return bytes([LAYOUTS.index(layout)]) + encoded
+
+
+def decode_discriminator(encoded, max_index, no_of_class, optional=False):
+    """Decodes a tagged bitmask into the same index form as decode_bitmask
+    (Optional) or decode_one_of (OneOf)"""
+    layout = LAYOUTS[encoded[0]]
+    encoded = encoded[1:]
+
+    if layout == "tree":
+        if optional:
+            return decode_bitmask(encoded, max_index)
+        return decode_one_of(encoded, max_index, no_of_class)
+    if layout == "runs":
+        return decode_runs(encoded)
+
+    if layout == "dense":
+        discriminator = decode_dense(encoded, max_index, no_of_class)
+    else:
+        discriminator = decode_alt(encoded, max_index, no_of_class)
+    if optional:
+        return list(bit_to_index(discriminator))
+    return list(one_of_to_index(discriminator, no_of_class))
@@ -0,0 +1,68 @@
+import sys
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """Rough retained size in bytes of a cached value"""
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, list):
+        return sys.getsizeof(value) + 8 * len(value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Least recently used cache, bounded by entry count and optionally by
+    an estimate of the bytes held. Hits and misses are counted for
+    monitoring."""
+
+    def __init__(self, max_size=64, max_bytes=None, sizeof=estimate_size):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entries = self.entries
+        if key not in entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entries.move_to_end(key)
+        return entries[key]
+
+    def put(self, key, value):
+        entries = self.entries
+        if self.max_bytes is not None:
+            size = self.sizeof(value)
+            self.size_bytes += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+        entries[key] = value
+        entries.move_to_end(key)
+        while entries and (
+            (self.max_size is not None and len(entries) > self.max_size)
+            or (self.max_bytes is not None and self.size_bytes > self.max_bytes)
+        ):
+            evicted, _ = entries.popitem(last=False)
+            self.size_bytes -= self.sizes.pop(evicted, 0)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.size_bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.size_bytes,
+        }
+
+    def __len__(self):
+        return len(self.entries)
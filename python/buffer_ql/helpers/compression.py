@@ -0,0 +1,72 @@
+import struct
+import lzma
+import zlib
+
+
+def shuffle(raw, width):
+    if width <= 1:
+        return raw
+    return b"".join(raw[i::width] for i in range(width))
+
+
+def unshuffle(data, width):
+    if width <= 1:
+        return data
+    n = len(data) // width
+    raw = bytearray(len(data))
+    for i in range(width):
+        raw[i::width] = data[i * n: (i + 1) * n]
+    return raw
+
+
+def xor_delta(raw, stride):
+    # every element XOR-ed with the previous one, computed as a single big
+    # int operation instead of a Python loop
+    bits = 8 * len(raw)
+    mask = (1 << bits) - 1
+    value = int.from_bytes(raw, "little")
+    return (value ^ ((value << 8 * stride) & mask)).to_bytes(len(raw), "little")
+
+
+def xor_undelta(data, stride):
+    # prefix XOR scan by doubling the shift
+    bits = 8 * len(data)
+    mask = (1 << bits) - 1
+    value = int.from_bytes(data, "little")
+    shift = 8 * stride
+    while shift < bits:
+        value ^= (value << shift) & mask
+        shift <<= 1
+    return value.to_bytes(len(data), "little")
+
+
+def compress(method, raw, size, width):
+    if method == "zlib":
+        return zlib.compress(raw)
+    if method == "lzma":
+        return lzma.compress(raw)
+    if method == "shuffle":
+        return zlib.compress(shuffle(raw, width))
+    if method == "xor":
+        return zlib.compress(shuffle(xor_delta(raw, size), width))
+    raise ValueError(f"Unknown compression {method}")
+
+
+def decompress(method, data, size, width):
+    if method == "zlib":
+        return zlib.decompress(data)
+    if method == "lzma":
+        return lzma.decompress(data)
+    if method == "shuffle":
+        return bytes(unshuffle(zlib.decompress(data), width))
+    if method == "xor":
+        return xor_undelta(unshuffle(zlib.decompress(data), width), size)
+    raise ValueError(f"Unknown compression {method}")
+
+
+COMPRESSIONS = ["zlib", "lzma", "shuffle", "xor"]
+
+
+def item_width(record):
+    fmt = record.get("format")
+    return struct.calcsize("<" + fmt) if fmt else record["size"]
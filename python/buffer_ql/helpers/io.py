@@ -1,3 +1,11 @@
+from array import array
+from hashlib import blake2b
+
+# header bit of containers whose index and length slots are fixed width
+# little endian integers instead of padded varints
+FIXED_WIDTH = 0x08
+
+
 def write_varint(dv, offset, value, signed=False):
     if signed:
         value = (value << 1) ^ (value >> 63)
@@ -8,6 +16,29 @@ def write_varint(dv, offset, value, signed=False):
     dv[offset] = value
 
 
+def read_varint(dv, offset, signed=False):
+    value = 0
+    shift = 0
+    while True:
+        byte = dv[offset]
+        offset += 1
+        value |= (byte & 127) << shift
+        shift += 7
+        if not byte & 128:
+            break
+    if signed:
+        return -(value >> 1) - 1 if value & 1 else value >> 1
+    return value
+
+
+def write_fixed_int(dv, offset, value, size, signed=False):
+    dv[offset: offset + size] = value.to_bytes(size, 'little', signed=signed)
+
+
+def read_fixed_int(dv, offset, size, signed=False):
+    return int.from_bytes(dv[offset: offset + size], 'little', signed=signed)
+
+
 def size_varint(value, signed=False):
     if signed:
         value = (value << 1) ^ (value >> 63)
@@ -28,17 +59,81 @@ def write_prefixed_varint(buffer, offset, value):
     return offset
 
 
+def encode_varint(value, signed=False):
+    if signed:
+        value = (value << 1) ^ (value >> 63)
+    encoded = bytearray()
+    write_prefixed_varint(encoded, 0, value)
+    return encoded
+
+
+def read_prefixed_varint(dv, offset):
+    _offset = read_varint(dv, offset, True)
+    value = 0
+    shift = 0
+    while True:
+        byte = dv[_offset]
+        _offset += 1
+        value |= (byte & 127) << shift
+        shift += 7
+        if not byte & 128:
+            break
+    return value, _offset
+
+
+def read_string(dv, offset):
+    return str(Data_Tape.read(dv, offset), 'utf-8')
+
+
+def serialize_string(value):
+    return value.encode('utf-8')
+
+
 def size_string(value, db):
-    encoded = value.encode('utf-8')
+    encoded = serialize_string(value)
     return db.put(encoded, value)
 
 
+def as_bytes(value):
+    view = memoryview(value)
+    return view.cast('B') if view.c_contiguous else memoryview(view.tobytes())
+
+
+def size_bytes(align=1):
+    # keyed by identity, the source list keeps every value alive until the
+    # container is assembled
+    def _size_bytes(value, db):
+        return db.put(as_bytes(value), id(value), align)
+    return _size_bytes
+
+
+def write_bytes(dv, offset, value, db):
+    return write_varint(dv, offset, db.get(id(value)), True)
+
+
 class Data_Tape:
-    def __init__(self):
-        self.buffer = bytearray()
+    def __init__(self, hash_threshold=None):
+        # values are kept as chunks and copied only once, when the container
+        # is assembled
+        self.chunks = []
         self.offset = 0
+        self.alignment = 1
         self.offset_delta = 0
         self.index = {}
+        # values encoding to more than hash_threshold bytes are keyed by
+        # digest so the tape does not hold on to large source objects
+        self.hash_threshold = hash_threshold
+
+    @staticmethod
+    def read(dv, offset):
+        length, _offset = read_prefixed_varint(dv, offset)
+        return dv[_offset: _offset + length]
+
+    @staticmethod
+    def read_entry(dv, offset):
+        length = read_varint(dv, offset)
+        _offset = offset + size_varint(length)
+        return dv[_offset: _offset + length]
 
     @staticmethod
     def write(dv, offset, value, db):
@@ -48,18 +143,65 @@ class Data_Tape:
         i = self.index.get(key, None)
         return -1 if i is None else i + self.offset_delta
     
-    def put(self, value, key):
+    def put(self, value, key, align=1):
         if key in self.index:
             return 0
-        self.index[key] = self.offset
         curr_offset = self.offset
-        next_offset = write_prefixed_varint(self.buffer, self.offset, len(value)) + len(value)
-        self.buffer.extend(value)
+        prefix = encode_varint(len(value))
+        # pad so that the value itself (not its length prefix) is aligned
+        padding = -(curr_offset + len(prefix)) % align
+        if padding:
+            self.chunks.append(bytes(padding))
+        self.index[key] = curr_offset + padding
+        self.chunks.append(prefix)
+        self.chunks.append(value)
+        next_offset = curr_offset + padding + len(prefix) + len(value)
         self.offset = next_offset
+        self.alignment = max(self.alignment, align)
         return next_offset - curr_offset
-    
+
+
+    def put_column(self, values, serialize):
+        index = self.index
+        hash_threshold = self.hash_threshold
+        offsets = array('q')
+        for value in values:
+            i = index.get(value, None)
+            if i is None:
+                encoded = serialize(value)
+                key = value
+                if hash_threshold is not None and len(encoded) > hash_threshold:
+                    key = blake2b(encoded, digest_size=16).digest()
+                    i = index.get(key, None)
+                if i is None:
+                    self.put(encoded, key)
+                    i = index[key]
+            offsets.append(i)
+        return offsets
+
+    @staticmethod
+    def write_column(dv, offset, offsets, db, size):
+        offset_delta = db.offset_delta
+        encoded = {}
+        chunks = []
+        for i in offsets:
+            chunk = encoded.get(i, None)
+            if chunk is None:
+                chunk = bytes(encode_varint(i + offset_delta, True).ljust(size, b'\0'))
+                encoded[i] = chunk
+            chunks.append(chunk)
+        dv[offset: offset + len(offsets) * size] = b''.join(chunks)
+
     def shift(self, to):
         self.offset_delta = to
 
+    def clear(self):
+        # the tape is reused for the next container
+        self.chunks = []
+        self.offset = 0
+        self.alignment = 1
+        self.offset_delta = 0
+        self.index = {}
+
     def export(self):
-        return self.buffer
+        return self.chunks
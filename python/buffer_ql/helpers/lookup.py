@@ -0,0 +1,63 @@
+import struct
+from zlib import crc32
+
+
+def hash_key(encoded):
+    # crc32 is stable across processes and platforms, unlike hash()
+    return crc32(encoded)
+
+
+def table_size(n):
+    size = 1
+    while size < 2 * n:
+        size <<= 1
+    return size
+
+
+# key hash and position + 1 per slot, a position of 0 marks an empty slot
+SLOT = struct.Struct("<II")
+
+
+def encode_hash_table(encoded_keys):
+    # open addressing with linear probing, the stored hash lets probes skip
+    # keys that only share a slot without decoding them
+    size = table_size(len(encoded_keys))
+    mask = size - 1
+    table = bytearray(SLOT.size * size)
+    for i, encoded in enumerate(encoded_keys):
+        key_hash = hash_key(encoded)
+        h = key_hash & mask
+        while SLOT.unpack_from(table, SLOT.size * h)[1]:
+            h = (h + 1) & mask
+        SLOT.pack_into(table, SLOT.size * h, key_hash, i + 1)
+    return bytes(table)
+
+
+def probe_hash_table(table, encoded, read_key):
+    size = len(table) // SLOT.size
+    if size == 0:
+        return -1
+    mask = size - 1
+    key_hash = hash_key(encoded)
+    h = key_hash & mask
+    while True:
+        slot_hash, entry = SLOT.unpack_from(table, SLOT.size * h)
+        if entry == 0:
+            return -1
+        if slot_hash == key_hash and read_key(entry - 1) == encoded:
+            return entry - 1
+        h = (h + 1) & mask
+
+
+def bisect_keys(n, encoded, read_key):
+    lo = 0
+    hi = n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if bytes(read_key(mid)) < encoded:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < n and read_key(lo) == encoded:
+        return lo
+    return -1
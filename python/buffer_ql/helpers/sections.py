@@ -0,0 +1,55 @@
+import struct
+import zlib
+
+from .io import read_varint, size_varint
+
+# Containers with per-column sections (secondary indexes, statistics) end
+# with a trailer pointing at a section directory, the last entry on the
+# data tape. Each directory record ties a column offset to the tape entry
+# holding its data. The header and the root are left as they are, readers
+# without sections support read such a container like any other.
+
+MAGIC = b"BQLS"
+INDEX_SECTION = 1
+STATS_SECTION = 2
+
+RECORD = struct.Struct("<BQQ")
+# directory offset, crc32 of the directory, magic
+TRAILER = struct.Struct("<QI4s")
+
+
+def create_directory(count):
+    return bytearray(RECORD.size * count)
+
+
+def fill_directory(directory, sections, db):
+    for i, (kind, writer, key) in enumerate(sections):
+        RECORD.pack_into(directory, i * RECORD.size,
+                         kind, writer.current_offset, db.get(key))
+
+
+def encode_trailer(directory_offset, directory):
+    return TRAILER.pack(directory_offset, zlib.crc32(directory), MAGIC)
+
+
+def read_sections(dv, read_entry):
+    # a container whose last value merely ends in the magic bytes has no
+    # directory ending right at the trailer with a matching checksum
+    sections = {}
+    end = len(dv) - TRAILER.size
+    if end < 0:
+        return sections
+    directory_offset, checksum, magic = TRAILER.unpack_from(dv, end)
+    if magic != MAGIC or directory_offset >= end:
+        return sections
+    length = read_varint(dv, directory_offset)
+    if directory_offset + size_varint(length) + length != end:
+        return sections
+    directory = read_entry(dv, directory_offset)
+    if len(directory) % RECORD.size or zlib.crc32(directory) != checksum:
+        return sections
+    for i in range(len(directory) // RECORD.size):
+        kind, column_offset, entry_offset = RECORD.unpack_from(
+            directory, i * RECORD.size)
+        sections.setdefault(kind, {})[column_offset] = entry_offset
+    return sections
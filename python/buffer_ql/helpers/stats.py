@@ -0,0 +1,52 @@
+import math
+import struct
+
+HEADER = struct.Struct("<IIH")
+BLOCK = struct.Struct("<ddI")
+
+
+def encode_zone_map(label, values, block_size):
+    encoded_label = label.encode("utf-8")
+    chunks = [HEADER.pack(block_size, len(values), len(encoded_label)), encoded_label]
+    for start in range(0, len(values), block_size):
+        block = values[start: start + block_size]
+        present = [v for v in block if v is not None]
+        if present:
+            chunks.append(BLOCK.pack(min(present), max(present), len(block) - len(present)))
+        else:
+            chunks.append(BLOCK.pack(math.nan, math.nan, len(block)))
+    return b"".join(chunks)
+
+
+def decode_zone_map(entry):
+    block_size, count, label_size = HEADER.unpack_from(entry, 0)
+    offset = HEADER.size
+    label = str(entry[offset: offset + label_size], "utf-8")
+    offset += label_size
+    blocks = [
+        BLOCK.unpack_from(entry, offset + i * BLOCK.size)
+        for i in range((len(entry) - offset) // BLOCK.size)
+    ]
+    return label, block_size, count, blocks
+
+
+def summarize_zone_maps(zone_maps):
+    summary = {"min": math.nan, "max": math.nan, "null_count": 0, "count": 0}
+    for _, _, count, blocks in zone_maps:
+        summary["count"] += count
+        for lo, hi, null_count in blocks:
+            summary["null_count"] += null_count
+            if math.isnan(lo):
+                continue
+            if math.isnan(summary["min"]) or lo < summary["min"]:
+                summary["min"] = lo
+            if math.isnan(summary["max"]) or hi > summary["max"]:
+                summary["max"] = hi
+    return summary
+
+
+def overlaps(block, lo, hi):
+    block_min, block_max, _ = block
+    if math.isnan(block_min):
+        return False
+    return block_max >= lo and block_min <= hi
@@ -1,5 +1,16 @@
 import struct
-from ..helpers.io import size_string, Data_Tape
+import sys
+from itertools import chain
+from ..helpers.io import (
+    size_string,
+    serialize_string,
+    read_string,
+    size_bytes,
+    write_bytes,
+    Data_Tape
+)
+
+LITTLE_ENDIAN = sys.byteorder == "little"
 
 
 def encode_uint8(dv, offset, value, *arg):
@@ -41,6 +52,120 @@ def encode_vec(size):
     return _encode_vec
 
 
+def decode_uint8(dv, offset):
+    return dv[offset]
+
+
+def decode_int8(dv, offset):
+    return struct.unpack_from("<b", dv, offset)[0]
+
+
+def decode_uint16(dv, offset):
+    return struct.unpack_from("<H", dv, offset)[0]
+
+
+def decode_int16(dv, offset):
+    return struct.unpack_from("<h", dv, offset)[0]
+
+
+def decode_uint32(dv, offset):
+    return struct.unpack_from("<I", dv, offset)[0]
+
+
+def decode_int32(dv, offset):
+    return struct.unpack_from("<i", dv, offset)[0]
+
+
+def decode_float32(dv, offset):
+    return struct.unpack_from("<f", dv, offset)[0]
+
+
+def decode_float64(dv, offset):
+    return struct.unpack_from("<d", dv, offset)[0]
+
+
+def decode_vec(size):
+    def _decode_vec(dv, offset):
+        return list(struct.unpack_from(f"<{size}f", dv, offset))
+    return _decode_vec
+
+
+def encode_column(fmt, size):
+    item_size = struct.calcsize("<" + fmt)
+    components = size // item_size
+
+    def _encode_column(dv, offset, values, *arg):
+        if isinstance(values, Unflattened):
+            flat = values.data
+        elif components > 1:
+            for value in values:
+                if len(value) != components:
+                    raise ValueError(
+                        f"Expected {components} components, got {len(value)}")
+            flat = chain.from_iterable(values)
+        else:
+            flat = values
+        count = len(values) * components
+        packed = pack_column(fmt, flat, count)
+        if len(packed) != count * item_size:
+            # a flat buffer that is not a whole number of items
+            raise ValueError(
+                f"Expected {count} values in the column, got {len(packed) // item_size}")
+        dv[offset: offset + count * item_size] = packed
+    return _encode_column
+
+
+def pack_column(fmt, values, count):
+    # buffers already holding little-endian values of the right type are
+    # copied as is, everything else goes through a single struct.pack call
+    if LITTLE_ENDIAN:
+        try:
+            view = memoryview(values)
+        except TypeError:
+            view = None
+        if (
+            view is not None
+            and view.format in (fmt, "<" + fmt)
+            and view.itemsize == struct.calcsize("<" + fmt)
+            and view.nbytes == count * view.itemsize
+            and view.c_contiguous
+        ):
+            return view.cast("B")
+    if hasattr(values, "astype") and casts_safely(values, fmt):
+        return values.astype("<" + fmt).tobytes()
+    if hasattr(values, "tolist"):
+        values = values.tolist()
+    return struct.pack(f"<{count}{fmt}", *values)
+
+
+INT_RANGES = {
+    fmt: (-(1 << (8 * size - 1)), (1 << (8 * size - 1)) - 1) if fmt.islower()
+    else (0, (1 << (8 * size)) - 1)
+    for fmt, size in (("b", 1), ("B", 1), ("h", 2), ("H", 2),
+                      ("i", 4), ("I", 4), ("q", 8), ("Q", 8))
+}
+FLOAT32_MAX = struct.unpack("<f", b"\xff\xff\x7f\x7f")[0]
+
+
+def casts_safely(values, fmt):
+    # NumPy astype wraps and truncates silently, it is only used when every
+    # value fits, anything else goes through struct.pack and raises
+    kind = getattr(getattr(values, "dtype", None), "kind", None)
+    if values.size == 0:
+        return kind is not None
+    if fmt in INT_RANGES:
+        lo, hi = INT_RANGES[fmt]
+        return kind in ("b", "i", "u") and lo <= values.min() and values.max() <= hi
+    if fmt == "d":
+        return kind in ("b", "i", "u", "f")
+    if fmt == "f":
+        if kind == "f" and values.dtype.itemsize > 4:
+            # non finite values fail the comparison and take the slow path
+            return abs(values).max() <= FLOAT32_MAX
+        return kind in ("b", "i", "u", "f")
+    return False
+
+
 def is_int(value):
     return isinstance(value, int)
 
@@ -53,12 +178,45 @@ def is_string(value):
     return isinstance(value, str)
 
 
+def is_bytes_like(value):
+    try:
+        memoryview(value)
+    except TypeError:
+        return False
+    return True
+
+
+# checks answered by the type of a value alone
+TYPE_CHECKS = (is_int, is_float, is_string, is_bytes_like)
+
+
 def is_list_of_floats(value, multiples_of=1):
-    return all([is_float(v) for v in value]) and len(value) % multiples_of == 0
+    return len(value) % multiples_of == 0 and all(is_float(v) for v in value)
+
+
+def is_flattened_floats(value, multiples_of=1):
+    try:
+        view = memoryview(value)
+    except TypeError:
+        return is_list_of_floats(value, multiples_of)
+    if view.format.lstrip("<") not in ("f", "d"):
+        return False
+    return (view.nbytes // view.itemsize) % multiples_of == 0
 
 
 class Unflattened:
     def __init__(self, data, size):
+        try:
+            view = memoryview(data)
+        except TypeError:
+            view = None
+        if view is not None and view.ndim > 1:
+            # NumPy arrays of shape (n, size), strided ones (e.g. arr[:, :3])
+            # are copied to be contiguous first
+            fmt = view.format
+            if not view.c_contiguous:
+                view = memoryview(view.tobytes())
+            data = view.cast("B").cast(fmt)
         self.data = data
         self.size = size
 
@@ -69,89 +227,144 @@ class Unflattened:
         return len(self.data) // self.size
 
 
+def aligned_bytes(align):
+    """Bytes variant whose payloads start at a multiple of align in the container"""
+    return {
+        "size": size_bytes(align),
+        "encode": write_bytes,
+        "decode": Data_Tape.read,
+        "check": is_bytes_like,
+    }
+
+
 SCHEMA_BASE_PRIMITIVE_TYPES = [
     {
         "name": "Uint8",
         "size": 1,
+        "format": "B",
+        "encode_column": encode_column("B", 1),
         "encode": encode_uint8,
+        "decode": decode_uint8,
         "check": is_int,
     },
     {
         "name": "Int8",
         "size": 1,
+        "format": "b",
+        "encode_column": encode_column("b", 1),
         "encode": encode_int8,
+        "decode": decode_int8,
         "check": is_int,
     },
     {
         "name": "Uint16",
         "size": 2,
+        "format": "H",
+        "encode_column": encode_column("H", 2),
         "encode": encode_uint16,
+        "decode": decode_uint16,
         "check": is_int,
     },
     {
         "name": "Int16",
         "size": 2,
+        "format": "h",
+        "encode_column": encode_column("h", 2),
         "encode": encode_int16,
+        "decode": decode_int16,
         "check": is_int,
     },
     {
         "name": "Uint32",
         "size": 4,
+        "format": "I",
+        "encode_column": encode_column("I", 4),
         "encode": encode_uint32,
+        "decode": decode_uint32,
         "check": is_int,
     },
     {
         "name": "Int32",
         "size": 4,
+        "format": "i",
+        "encode_column": encode_column("i", 4),
         "encode": encode_int32,
+        "decode": decode_int32,
         "check": is_int,
     },
     {
         "name": "Float32",
         "size": 4,
+        "format": "f",
+        "encode_column": encode_column("f", 4),
         "encode": encode_float32,
+        "decode": decode_float32,
         "check": is_float,
     },
     {
         "name": "Float64",
         "size": 8,
+        "format": "d",
+        "encode_column": encode_column("d", 8),
         "encode": encode_float64,
+        "decode": decode_float64,
         "check": is_float,
     },
     {
         "name": "String",
         "size": size_string,
+        "serialize": serialize_string,
         "encode": Data_Tape.write,
+        "decode": read_string,
         "check": is_string,
     },
+    {
+        "name": "Bytes",
+        **aligned_bytes(1),
+    },
     {
         "name": "Vector2",
         "size": 8,
+        "format": "f",
+        "encode_column": encode_column("f", 8),
         "encode": encode_vec(2),
+        "decode": decode_vec(2),
         "check": lambda value: is_list_of_floats(value, 2),
     },
     {
         "name": "Vector3",
         "size": 12,
+        "format": "f",
+        "encode_column": encode_column("f", 12),
         "encode": encode_vec(3),
-        "check": lambda value: is_list_of_floats(value, 3)
+        "decode": decode_vec(3),
+        "check": lambda value: is_list_of_floats(value, 3),
     },
     {
         "name": "Vector4",
         "size": 16,
+        "format": "f",
+        "encode_column": encode_column("f", 16),
         "encode": encode_vec(4),
+        "decode": decode_vec(4),
         "check": lambda value: is_list_of_floats(value, 4),
     },
     {
         "name": "Matrix3",
         "size": 36,
+        "format": "f",
+        "encode_column": encode_column("f", 36),
         "encode": encode_vec(9),
+        "decode": decode_vec(9),
         "check": lambda value: is_list_of_floats(value, 9),
     },
     {
         "name": "Matrix4",
         "size": 64,
+        "format": "f",
+        "encode_column": encode_column("f", 64),
         "encode": encode_vec(16),
+        "decode": decode_vec(16),
         "check": lambda value: is_list_of_floats(value, 16),
     },
 ]
@@ -162,34 +375,34 @@ SCHEMA_BASE_COMPOUND_TYPES = [
         "type": "Array",
         "children": ["Vector2"],
         "transform": lambda arr: Unflattened(arr, 2),
-        "check": lambda value: is_list_of_floats(value, 2),
+        "check": lambda value: is_flattened_floats(value, 2),
     },
     {
         "name": "Vector3Array",
         "type": "Array",
         "children": ["Vector3"],
         "transform": lambda arr: Unflattened(arr, 3),
-        "check": lambda value: is_list_of_floats(value, 3),
+        "check": lambda value: is_flattened_floats(value, 3),
     },
     {
         "name": "Vector4Array",
         "type": "Array",
         "children": ["Vector4"],
         "transform": lambda arr: Unflattened(arr, 4),
-        "check": lambda value: is_list_of_floats(value, 4),
+        "check": lambda value: is_flattened_floats(value, 4),
     },
     {
         "name": "Matrix3Array",
         "type": "Array",
         "children": ["Matrix3"],
         "transform": lambda arr: Unflattened(arr, 9),
-        "check": lambda value: is_list_of_floats(value, 9),
+        "check": lambda value: is_flattened_floats(value, 9),
     },
     {
         "name": "Matrix4Array",
         "type": "Array",
         "children": ["Matrix4"],
         "transform": lambda arr: Unflattened(arr, 16),
-        "check": lambda value: is_list_of_floats(value, 16),
+        "check": lambda value: is_flattened_floats(value, 16),
     },
 ]
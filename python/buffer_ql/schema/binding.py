@@ -0,0 +1,66 @@
+from dataclasses import is_dataclass
+from operator import attrgetter
+
+
+class Binding:
+    """Class bound to a NamedTuple type. Fields are extracted with a single
+    compiled attrgetter on encode, and instances are constructed on decode.
+
+    Dataclasses, attrs classes and typing.NamedTuple are built through their
+    constructor, any other class (e.g. with __slots__) is filled attribute
+    by attribute.
+    """
+
+    def __init__(self, cls, keys):
+        self.cls = cls
+        self.keys = keys
+        self.getter = attrgetter(*keys) if keys else (lambda value: ())
+        self.by_init = (
+            is_dataclass(cls)
+            or hasattr(cls, "__attrs_attrs__")
+            or (issubclass(cls, tuple) and hasattr(cls, "_fields"))
+        )
+
+    def columns(self, values):
+        if len(self.keys) == 1:
+            return [list(map(self.getter, values))]
+        columns = list(zip(*map(self.getter, values)))
+        return [list(column) for column in columns] or [[] for _ in self.keys]
+
+    def construct(self, fields):
+        cls = self.cls
+        if self.by_init:
+            return cls(**fields)
+        instance = cls.__new__(cls)
+        for key, value in fields.items():
+            setattr(instance, key, value)
+        return instance
+
+
+def field_columns(record, values):
+    """One column of values per key of a NamedTuple type, from dicts, bound
+    class instances or any object exposing the keys as attributes"""
+    keys = record["keys"]
+    bind = record.get("bind")
+    if bind is not None and not any(isinstance(value, dict) for value in values):
+        return bind.columns(values)
+    return [[_field(value, key) for value in values] for key in keys]
+
+
+def _field(value, key):
+    if isinstance(value, dict):
+        return value.get(key)
+    if not has_fields(value, (key,)):
+        raise TypeError(
+            f"Expected a dict or an object with a {key} field, got {type(value).__name__}")
+    return getattr(value, key)
+
+
+def has_fields(value, keys):
+    # plain values (str, list, numbers...) never stand in for a record
+    # through attributes they happen to share with it
+    if isinstance(value, dict):
+        return True
+    if isinstance(value, (str, bytes, list, tuple, int, float)) and not hasattr(value, "_fields"):
+        return False
+    return all(hasattr(value, key) for key in keys)
@@ -1,8 +1,13 @@
+import struct
+
 from .base import SCHEMA_BASE_PRIMITIVE_TYPES, SCHEMA_BASE_COMPOUND_TYPES
 from .compound import parse_expression
+from ..helpers.compression import COMPRESSIONS
+from ..helpers.bitmask_alt import BITMASK_LAYOUTS
+from .binding import Binding
 
 
-def extend_schema(base_types, types, transforms={}, checks={}):
+def extend_schema(base_types, types, transforms={}, checks={}, annotations={}):
     schema = {}
 
     for record in SCHEMA_BASE_PRIMITIVE_TYPES:
@@ -51,8 +56,11 @@ def extend_schema(base_types, types, transforms={}, checks={}):
                 add_records(parse_expression(_label, exp))
 
     validate_schema(schema)
+    aliases = set(label for label, record in schema.items()
+                  if record["type"] == "Alias")
     forward_alias(schema)
     mark_refs(schema)
+    apply_annotations(schema, annotations, aliases)
     return schema
 
 
@@ -115,6 +123,143 @@ def forward_alias(schema, replaced=0):
         forward_alias(schema, replaced + count)
 
 
+def apply_annotations(schema, annotations, aliases):
+    # annotations on a type definition carry over to every alias of it,
+    # annotations on an alias (a path like Pose.position) stay on that path
+    ordered = sorted(annotations.items(), key=lambda x: x[0] in aliases)
+    for label, annotation in ordered:
+        if label not in schema:
+            raise TypeError(f'Missing type definition {label} for annotation')
+        record = schema[label]
+        annotated = {**record, **annotation}
+        validate_annotation(label, annotated, schema)
+        if annotated.get("packed"):
+            pack_fields(label, annotated, schema)
+        if isinstance(annotated.get("bind"), type):
+            annotated["bind"] = Binding(annotated["bind"], annotated["keys"])
+        if label in aliases:
+            schema[label] = annotated
+        else:
+            for _label, _record in schema.items():
+                if _record is record:
+                    schema[_label] = annotated
+
+
+KEY_INDEXES = ["sorted", "hash"]
+
+
+def validate_annotation(label, record, schema):
+    compression = record.get("compression")
+    if compression:
+        if record["type"] != "Primitive" or type(record["size"]) != int:
+            raise TypeError(
+                f'Compression on {label} requires a fixed size primitive type')
+        if compression not in COMPRESSIONS:
+            raise TypeError(
+                f'Unknown compression {compression} on {label}. Use one of {", ".join(COMPRESSIONS)}')
+
+    if record.get("indexed"):
+        if record["type"] != "Primitive":
+            raise TypeError(f'Index on {label} requires a primitive type')
+
+    if record.get("stats"):
+        column = record
+        if record["type"] == "Optional":
+            column = schema[record["children"][0]]
+        if not is_scalar(column):
+            raise TypeError(
+                f'Stats on {label} require a numeric primitive type or an Optional of one')
+
+    layout = record.get("bitmask")
+    if layout:
+        if record["type"] not in ("Optional", "OneOf"):
+            raise TypeError(
+                f'Bitmask layout on {label} requires an Optional or OneOf type')
+        if layout not in BITMASK_LAYOUTS:
+            raise TypeError(
+                f'Unknown bitmask layout {layout} on {label}. Use one of {", ".join(BITMASK_LAYOUTS)}')
+        if layout == "alt" and record["type"] != "OneOf":
+            raise TypeError(f'Bitmask layout alt on {label} requires a OneOf type')
+
+    if record.get("packed"):
+        if record["type"] != "NamedTuple":
+            raise TypeError(f'Packed layout on {label} requires a NamedTuple type')
+        for child in record["children"]:
+            child_record = schema[child]
+            if (
+                child_record["type"] != "Primitive"
+                or type(child_record["size"]) != int
+                or "format" not in child_record
+                or child_record.get("compression")
+            ):
+                raise TypeError(
+                    f'Packed layout on {label} requires fixed size primitive fields, {child} is not')
+
+    if record.get("bind") is not None:
+        if record["type"] != "NamedTuple":
+            raise TypeError(f'Class binding on {label} requires a NamedTuple type')
+        if not isinstance(record["bind"], (type, Binding)):
+            raise TypeError(f'Class binding on {label} expects a class')
+
+    key_index = record.get("key_index")
+    if key_index:
+        if record["type"] != "Map":
+            raise TypeError(f'Key index on {label} requires a Map type')
+        if key_index not in KEY_INDEXES:
+            raise TypeError(
+                f'Unknown key index {key_index} on {label}. Use one of {", ".join(KEY_INDEXES)}')
+
+
+def pack_fields(label, record, schema):
+    # rows are stored as one little endian struct, every field gets a
+    # primitive type reading at its offset within the row
+    fields = []
+    fmt = "<"
+    align = 1
+    for key, child in zip(record["keys"], record["children"]):
+        child_record = schema[child]
+        item_size = struct.calcsize("<" + child_record["format"])
+        count = child_record["size"] // item_size
+        align = max(align, item_size)
+        fields.append((key, count, struct.calcsize(fmt), child_record))
+        fmt += f'{count}{child_record["format"]}'
+    row = struct.Struct(fmt)
+
+    packed_fields = []
+    for key, count, shift, child_record in fields:
+        field_label = f'{label}.{key}(Packed)'
+        schema[field_label] = {
+            "type": "Primitive",
+            "size": row.size,
+            "decode": shift_decode(child_record["decode"], shift),
+            "check": child_record.get("check"),
+        }
+        packed_fields.append(field_label)
+
+    record["size"] = row.size
+    # the column is aligned to its widest field, not to the row size
+    record["align"] = align
+    record["row"] = row
+    record["fields"] = [(key, count) for key, count, _, _ in fields]
+    record["packed_fields"] = packed_fields
+
+
+def shift_decode(decode, shift):
+    def _decode(dv, offset):
+        return decode(dv, offset + shift)
+    return _decode
+
+
+def is_scalar(record):
+    fmt = record.get("format")
+    return (
+        record["type"] == "Primitive"
+        and fmt is not None
+        and len(fmt) == 1
+        and struct.calcsize("<" + fmt) == record["size"]
+    )
+
+
 def mark_refs(schema):
     for _, record in schema.items():
         if record["type"] == "Ref":
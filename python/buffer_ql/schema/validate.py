@@ -0,0 +1,171 @@
+import struct
+from itertools import chain
+
+from .binding import field_columns, has_fields
+
+
+class Column:
+    """Values of one type gathered across the whole input, with the way
+    back to their parents to name the path of a failing value"""
+
+    def __init__(self, type_name, values, parent=None, parents=None, steps=None):
+        self.type_name = type_name
+        self.values = values
+        self.parent = parent
+        self.parents = parents
+        self.steps = steps
+
+    def path(self, i):
+        column = self
+        parts = []
+        while column.parent is not None:
+            step = column.steps if isinstance(column.steps, str) else column.steps[i]
+            parts.append(step)
+            i = column.parents[i]
+            column = column.parent
+        return column.type_name + "".join(reversed(parts))
+
+
+def validate_data(schema, data, root_type):
+    """Checks data against root_type one column at a time, without encoding
+    it. Raises ValueError naming the path of the first value that does not
+    fit its type, e.g. #[3].position[1]"""
+    stack = [Column(root_type, [data])]
+
+    while stack:
+        column = stack.pop()
+        record = schema[column.type_name]
+        values = column.values
+        kind = record["type"]
+
+        if kind == "Primitive":
+            i = check_column(record, values)
+            if i >= 0:
+                fail(column, i)
+            continue
+        if kind in ("Ref", "Link") or not values:
+            continue
+
+        check = record.get("check")
+        if check is not None:
+            i = next((i for i, value in enumerate(values) if not check(value)), -1)
+            if i >= 0:
+                fail(column, i)
+        transform = record.get("transform")
+        if transform:
+            values = [transform(value) for value in values]
+
+        if kind == "Tuple":
+            children = record["children"]
+            for i, value in enumerate(values):
+                if _size(value) != len(children):
+                    fail(column, i)
+            positions = range(len(values))
+            for j in range(len(children) - 1, -1, -1):
+                stack.append(Column(children[j], [value[j] for value in values],
+                                    column, positions, f"[{j}]"))
+
+        elif kind == "NamedTuple":
+            for i, value in enumerate(values):
+                if not has_fields(value, record["keys"]):
+                    fail(column, i)
+            positions = range(len(values))
+            columns = field_columns(record, values)
+            for key, child, child_values in reversed(list(
+                    zip(record["keys"], record["children"], columns))):
+                stack.append(Column(child, child_values,
+                                    column, positions, f".{key}"))
+
+        elif kind == "Array":
+            parents = []
+            steps = []
+            child_values = []
+            for i, value in enumerate(values):
+                size = _size(value)
+                if size < 0:
+                    fail(column, i)
+                # indexed rather than iterated, slices of an Unflattened
+                # buffer never run out
+                child_values.extend(value[j] for j in range(size))
+                parents.extend([i] * size)
+                steps.extend(f"[{j}]" for j in range(size))
+            stack.append(Column(record["children"][0], child_values,
+                                column, parents, steps))
+
+        elif kind == "Map":
+            parents = []
+            steps = []
+            child_values = []
+            for i, value in enumerate(values):
+                if not isinstance(value, dict) or not all(isinstance(key, str) for key in value):
+                    fail(column, i)
+                child_values.extend(value.values())
+                parents.extend([i] * len(value))
+                steps.extend(f"[{key!r}]" for key in value)
+            stack.append(Column(record["children"][0], child_values,
+                                column, parents, steps))
+
+        elif kind == "Optional":
+            parents = [i for i, value in enumerate(values) if value is not None]
+            stack.append(Column(record["children"][0], [values[i] for i in parents],
+                                column, parents, ""))
+
+        elif kind == "OneOf":
+            children = record["children"]
+            checks = [schema[child]["check"] for child in children]
+            branches = [[] for _ in children]
+            for i, value in enumerate(values):
+                k = next((k for k, check in enumerate(checks) if check(value)), -1)
+                if k < 0:
+                    fail(column, i)
+                branches[k].append(i)
+            for k in range(len(children) - 1, -1, -1):
+                stack.append(Column(children[k], [values[i] for i in branches[k]],
+                                    column, branches[k], ""))
+
+
+def check_column(record, values):
+    """Position of the first value of a primitive column that would not
+    encode, or -1. Fixed size columns are tried with a single struct.pack
+    and only searched value by value when that fails."""
+    fmt = record.get("format")
+    if fmt is not None and isinstance(record.get("size"), int):
+        components = record["size"] // struct.calcsize("<" + fmt)
+        try:
+            if components > 1:
+                i = next((i for i, value in enumerate(values)
+                          if _size(value) != components), -1)
+                if i >= 0:
+                    return i
+                flat = chain.from_iterable(values)
+            else:
+                flat = values
+            struct.pack(f"<{len(values) * components}{fmt}", *flat)
+            return -1
+        except (struct.error, TypeError, OverflowError):
+            single = struct.Struct(f"<{components}{fmt}")
+            for i, value in enumerate(values):
+                try:
+                    single.pack(*(value if components > 1 else (value,)))
+                except (struct.error, TypeError, OverflowError):
+                    return i
+            return -1
+
+    check = record.get("check")
+    if check is None:
+        return -1
+    return next((i for i, value in enumerate(values) if not check(value)), -1)
+
+
+def fail(column, i):
+    raise ValueError(
+        f'Invalid value {column.values[i]!r} at {column.path(i)}, expected {column.type_name}')
+
+
+def _size(value):
+    if isinstance(value, (str, dict)):
+        return -1
+    try:
+        return len(value)
+    except TypeError:
+        return -1
@@ -1,7 +1,8 @@
 from pathlib import Path
 import json
+import pytest
 
-from buffer_ql import create_encoder
+from buffer_ql import create_encoder, ALL_VALUES
 
 from .test_schema import SCHEMA
 
@@ -21,3 +22,865 @@ encoded = create_encoder(SCHEMA)(dummy_data, "#")
 
 with open(curr_dir / ".." / ".." / "test" / "encodedPY.bin", "wb") as f:
     f.write(encoded)
+
+
+def test_vector_array_inputs():
+    from array import array
+    from buffer_ql import extend_schema
+
+    schema = extend_schema({}, {"#": {"points": "Vector3Array"}})
+    encode = create_encoder(schema)
+    points = [0.5, 1.5, 2.5, -1.0, 0.25, 8.0]
+
+    expected = encode({"points": points}, "#")
+    assert encode({"points": array("f", points)}, "#") == expected
+    assert encode({"points": array("d", points)}, "#") == expected
+    assert encode({"points": memoryview(array("f", points))}, "#") == expected
+
+    # vectors of the wrong size are not regrouped into whole ones
+    vectors = create_encoder(extend_schema({}, {"#": "Array<Vector3>"}))
+    with pytest.raises(ValueError):
+        vectors([[1, 2], [3, 4, 5, 6]], "#")
+
+
+def test_numpy_column_inputs():
+    import struct
+    np = pytest.importorskip("numpy")
+    from buffer_ql import extend_schema
+
+    schema = extend_schema({}, {"#": {"points": "Vector3Array", "u": "Array<Uint8>",
+                                      "i": "Array<Int32>", "f": "Array<Float32>"}})
+    encode = create_encoder(schema)
+    points = [0.5, 1.5, 2.5, -1.0, 0.25, 8.0]
+    value = {"points": points, "u": [1, 255], "i": [1, -2], "f": [0.5, 2.0]}
+    expected = encode(value, "#")
+
+    padded = np.array([[0.5, 1.5, 2.5, 9.0], [-1.0, 0.25, 8.0, 9.0]])
+    assert encode({**value, "points": padded[:, :3]}, "#") == expected
+    assert encode({**value, "points": np.array(points).reshape(2, 3)}, "#") == expected
+    assert encode({**value, "u": np.array([1, 255]), "i": np.array([1, -2], dtype=np.int8),
+                   "f": np.array([0.5, 2.0])}, "#") == expected
+
+    with pytest.raises(struct.error):
+        encode({**value, "u": np.array([1, 300])}, "#")
+    with pytest.raises(struct.error):
+        encode({**value, "i": np.array([1.7, 2.0])}, "#")
+    with pytest.raises(OverflowError):
+        encode({**value, "f": np.array([1e300])}, "#")
+    with pytest.raises(ValueError):
+        encode({**value, "points": np.array(points + [1.0])}, "#")
+
+
+def test_string_tape_hashing():
+    from buffer_ql import extend_schema
+
+    schema = extend_schema({}, {"#": {"names": "Array<String>"}})
+    data = {"names": ["ego", "x" * 100, "ego", "x" * 100, ""]}
+
+    expected = create_encoder(schema)(data, "#")
+    assert create_encoder(schema, hash_threshold=16)(data, "#") == expected
+    assert expected.count(b"x" * 100) == 1
+
+
+def test_round_trip():
+    from buffer_ql import create_reader, ALL_VALUES
+
+    Reader = create_reader(encoded, SCHEMA)
+    root = Reader("#")
+    decoded = root.value()
+
+    assert [e["id"] for e in decoded["trackedEntities"]] == \
+        [e["id"] for e in tracked_entities]
+    assert [e["source"] for e in decoded["trackedEntities"]] == \
+        [e["source"] for e in tracked_entities]
+    assert decoded["trackedEntitiesOfInterest"]["mostConstraining"]["id"] == \
+        tracked_entities_of_interest["mostConstraining"]["id"]
+
+    probabilities = root.get("trackedEntities").get(ALL_VALUES) \
+        .get("waypoints").get(ALL_VALUES).get("probability").value()
+    for entity, values in zip(tracked_entities, probabilities):
+        if values is None:
+            assert entity.get("waypoints") is None
+            continue
+        expected = [w.get("probability") for w in entity["waypoints"]]
+        assert [v is None for v in values] == [v is None for v in expected]
+
+
+def test_bytes():
+    from array import array
+    from buffer_ql import extend_schema, aligned_bytes, create_reader, ALL_VALUES
+
+    schema = extend_schema(
+        {"Blob": aligned_bytes(8)},
+        {"#": {"raw": "Array<Bytes>", "aligned": "Blob"}}
+    )
+    payload = array("d", [1.0, 2.0, 3.0])
+    data = {"raw": [b"abc", bytearray(b"\x00\x01"), memoryview(b"")], "aligned": payload}
+    encoded = create_encoder(schema)(data, "#")
+
+    root = create_reader(encoded, schema)("#")
+    raw = root.get("raw").get(ALL_VALUES).value()
+    assert all(isinstance(v, memoryview) for v in raw)
+    assert [bytes(v) for v in raw] == [b"abc", b"\x00\x01", b""]
+
+    aligned = root.get("aligned").value()
+    assert aligned.obj is encoded
+    assert aligned.tobytes() == payload.tobytes()
+    assert encoded.index(payload.tobytes()) % 8 == 0
+    assert list(aligned.cast("d")) == [1.0, 2.0, 3.0]
+
+
+def test_compression():
+    from buffer_ql import extend_schema, create_reader, ALL_VALUES
+
+    types = {
+        "#": "Array<WayPoint>",
+        "WayPoint": {"timestamp": "Int32", "position": "Vector3"},
+    }
+    data = [{"timestamp": i * 100, "position": [i * 0.5, 1.0, -2.0]}
+            for i in range(200)]
+    plain = create_encoder(extend_schema({}, types))(data, "#")
+
+    for compression in ["zlib", "lzma", "shuffle", "xor"]:
+        schema = extend_schema({}, types, annotations={
+            "WayPoint.timestamp": {"compression": compression},
+            "Vector3": {"compression": compression},
+        })
+        assert "compression" not in schema["Int32"]
+        encoded = create_encoder(schema)(data, "#")
+        assert len(encoded) < len(plain)
+
+        waypoints = create_reader(encoded, schema)("#").get(ALL_VALUES)
+        assert waypoints.get("timestamp").value() == [w["timestamp"] for w in data]
+        assert waypoints.get("position").value() == [w["position"] for w in data]
+        assert list(waypoints.get("timestamp").dump()) == [w["timestamp"] for w in data]
+
+
+def test_links(tmp_path):
+    from buffer_ql import extend_schema, create_reader, ReaderPool, ALL_VALUES
+
+    path = tmp_path / "entities.bin"
+    path.write_bytes(encoded)
+
+    pool = ReaderPool(max_open=1)
+    pool.register("Scene", path, SCHEMA)
+
+    schema = extend_schema({}, {
+        "#": {
+            "nearest": "Link<Scene/TrackedEntity>",
+            "all": "Array<Link<Scene/TrackedEntity>>",
+        }
+    })
+    entities = pool.locate("Scene", ["trackedEntities"])
+    data = {
+        "nearest": pool.locate("Scene", ["trackedEntities", 2]),
+        "all": [entities.get(i) for i in range(3)] + [None],
+    }
+    linked = create_encoder(schema)(data, "#")
+
+    root = pool.attach(create_reader(linked, schema))("#")
+    assert root.get("nearest").get("id").value() == tracked_entities[2]["id"]
+    assert root.get("all").get(ALL_VALUES).get("id").value() == \
+        [e["id"] for e in tracked_entities[:3]] + [None]
+    pool.close()
+
+    # links are sized from their slots, the linked container is not opened
+    from buffer_ql import inspect_container
+
+    report = inspect_container(linked, schema)
+    links = [entry for entry in report.paths.values() if entry.kind == "Link"]
+    assert sum(entry.values for entry in links) == 5
+    assert sum(entry.payload for entry in links) == 8 * 5
+    assert sum(entry.total for entry in report.paths.values()) <= len(linked)
+
+
+def test_map_key_index():
+    from buffer_ql import extend_schema, create_reader, ALL_KEYS
+
+    types = {"#": "Map<Int32>"}
+    data = {f"key{i * 7 % 100}": i for i in range(100)}
+    data["ünïcode"] = -1
+
+    for key_index in ["sorted", "hash"]:
+        schema = extend_schema({}, types, annotations={
+            "#": {"key_index": key_index}})
+        encoded = create_encoder(schema)(data, "#")
+        root = create_reader(encoded, schema)("#")
+
+        assert root.value() == data
+        assert root.get("key42").value() == data["key42"]
+        assert root.get("ünïcode").value() == -1
+        assert root.get("missing").value() is None
+        assert root.get(["key1", "missing", "key99"]).value() == \
+            [data["key1"], None, data["key99"]]
+        if key_index == "sorted":
+            assert root.get(ALL_KEYS).value() == sorted(data)
+
+    # keys are only decoded when their stored hash matches
+    from buffer_ql.helpers.lookup import encode_hash_table, probe_hash_table
+
+    keys = [key.encode() for key in data]
+    table = encode_hash_table(keys)
+    reads = []
+
+    def read_key(i):
+        reads.append(i)
+        return keys[i]
+    for i, key in enumerate(keys):
+        assert probe_hash_table(table, key, read_key) == i
+    assert probe_hash_table(table, b"missing", read_key) == -1
+    assert len(reads) == len(keys)
+
+
+def test_secondary_index():
+    from buffer_ql import extend_schema, create_reader, ALL_VALUES
+
+    schema = extend_schema(
+        {},
+        {
+            "#": {"entities": "Array<Entity>"},
+            "Entity": {"id": "Int32", "name": "String"},
+        },
+        annotations={
+            "Entity.id": {"indexed": True},
+            "Entity.name": {"indexed": True},
+        }
+    )
+    ids = [7, 3, 9, 3, -1, 12]
+    data = {"entities": [{"id": i, "name": f"e{i}"} for i in ids]}
+    encoded = create_encoder(schema)(data, "#")
+
+    entities = create_reader(encoded, schema)("#").get("entities")
+    column = entities.get(ALL_VALUES).get("id")
+    assert column.lookup(3) == [1, 3]
+    assert column.lookup(12) == [5]
+    assert column.lookup(4) == []
+    assert entities.get(ALL_VALUES).get("name").lookup("e9") == [2]
+    assert entities.get(column.lookup(-1)).get("name").value() == ["e-1"]
+
+
+def test_zone_maps():
+    from buffer_ql import extend_schema, create_reader, container_stats, ALL_VALUES
+
+    schema = extend_schema(
+        {},
+        {
+            "#": "Array<WayPoint>",
+            "WayPoint": {"timestamp": "Int32", "probability": "Optional<Float32>"},
+        },
+        annotations={
+            "WayPoint.timestamp": {"stats": 4},
+            "WayPoint.probability": {"stats": 4},
+        }
+    )
+    data = [{"timestamp": i * 10, "probability": None if i % 3 else 0.5}
+            for i in range(10)]
+    encoded = create_encoder(schema)(data, "#")
+    Reader = create_reader(encoded, schema)
+    waypoints = Reader("#").get(ALL_VALUES)
+
+    label, block_size, count, blocks = waypoints.get("timestamp").zone_map()
+    assert (label, block_size, count) == ("WayPoint.timestamp", 4, 10)
+    assert [b[:2] for b in blocks] == [(0, 30), (40, 70), (80, 90)]
+    assert waypoints.get("timestamp").between(25, 45) == [3, 4]
+
+    assert waypoints.get("probability").between(0, 1) == [0, 3, 6, 9]
+    assert Reader("#").get([8, 9, 3]).get("timestamp").between(80, 95) == [0, 1]
+    assert Reader("#").get([9, 1, 6]).get("probability").between(0, 1) == [0, 2]
+    assert container_stats(Reader, "WayPoint.probability") == \
+        {"min": 0.5, "max": 0.5, "null_count": 6, "count": 10}
+
+
+def test_bitmask_layouts():
+    from buffer_ql import extend_schema, create_reader
+    from buffer_ql.helpers.bitmask_alt import (
+        LAYOUTS, encode_discriminator, decode_discriminator)
+    from buffer_ql.helpers.bitmask import one_of_to_index
+
+    discriminator = [0, 0, 2, 1, 1, 1, 0, 2, 2, 0, 1]
+    expected = list(one_of_to_index(discriminator, 3))
+    for layout in LAYOUTS:
+        encoded = encode_discriminator(discriminator, 3, layout)
+        assert encoded[0] == LAYOUTS.index(layout)
+        assert list(decode_discriminator(
+            encoded, len(discriminator), 3)) == expected
+
+    # alternating values favour the dense bitmap over the tree
+    encoded = encode_discriminator([i % 2 for i in range(64)], 2, "adaptive", True)
+    assert LAYOUTS[encoded[0]] == "dense"
+
+    data = {"a": [None if i % 2 else i for i in range(20)],
+            "b": [i if i % 3 else str(i) for i in range(20)]}
+    for layout in ["adaptive", *LAYOUTS[:3]]:
+        schema = extend_schema(
+            {}, {"#": {"a": "Array<Optional<Int32>>", "b": "Array<OneOf<String,Int32>>"}},
+            annotations={
+                "#.a(Array)": {"bitmask": layout},
+                "#.b(Array)": {"bitmask": layout},
+            })
+        reader = create_reader(create_encoder(schema)(data, "#"), schema)("#")
+        for key, values in data.items():
+            assert [reader.get(key).get(i).value() for i in range(20)] == values
+
+
+def test_plan_cache():
+    from buffer_ql import extend_schema
+
+    schema = extend_schema(
+        {},
+        {
+            "#": "Array<Frame>",
+            "Frame": {
+                "name": "String",
+                "position": "Vector3",
+                "tags": "Map<Int32>",
+                "score": "Optional<Float64>",
+                "samples": "Array<Int32>",
+            },
+        },
+        annotations={"Frame.position": {"compression": "zlib"}}
+    )
+
+    def frame(t, name_length=4):
+        return [
+            {
+                "name": str(t) * name_length,
+                "position": [t, t + 1, t + 2],
+                "tags": {"a": t, "b": -t},
+                "score": None if i % 2 else t / 2,
+                "samples": [t * i, t + i],
+            }
+            for i in range(3)
+        ]
+
+    cached = create_encoder(schema, plan_cache_size=4)
+    fresh = create_encoder(schema)
+    # same shape with changing values, then a tape large enough to widen
+    # the index slots
+    for data in [frame(1), frame(2), frame(3), frame(4, 200), frame(5)]:
+        assert cached(data, "#") == fresh(data, "#")
+    # same number of frames, a column deeper down changes length
+    longer = frame(6)
+    longer[2]["samples"].append(7)
+    for data in [longer, frame(7), longer]:
+        assert cached(data, "#") == fresh(data, "#")
+
+    # columns rewritten on the tape for every value of the same shape
+    schema = extend_schema(
+        {},
+        {"#": "Array<Entry>",
+         "Entry": {"id": "Int32", "value": "OneOf<String,Int32>",
+                   "lookup": "Map<Int32>", "score": "Optional<Float64>"}},
+        annotations={"Entry.id": {"indexed": True}, "Entry.score": {"stats": 2},
+                     "Entry.lookup": {"key_index": "hash"}}
+    )
+    cached = create_encoder(schema, plan_cache_size=4)
+    fresh = create_encoder(schema)
+    for t in range(3):
+        data = [{"id": (i * 7 + t) % 5, "value": str(t) * i if (i + t) % 2 else i,
+                 "lookup": {str(t): t, "k": i}, "score": None if i == t else t / 2}
+                for i in range(4)]
+        assert cached(data, "#") == fresh(data, "#")
+
+    cached = create_encoder(SCHEMA, plan_cache_size=4)
+    for _ in range(2):
+        assert cached(dummy_data, "#") == encoded
+
+
+def test_encode_many():
+    from buffer_ql import extend_schema, create_reader
+
+    schema = extend_schema({}, {"#": {"id": "Int32", "topic": "String"}})
+    records = [{"id": i, "topic": "t" * (i % 3)} for i in range(10)]
+    encoder = create_encoder(schema)
+
+    encoded = encoder.encode_many(records, "#")
+    assert encoded == [encoder(record, "#") for record in records]
+
+    buffer, offsets = encoder.encode_many(records, "#", concat=True)
+    assert len(offsets) == len(records) + 1 and offsets[-1] == len(buffer)
+    for record, start, end in zip(records, offsets, offsets[1:]):
+        reader = create_reader(buffer[start:end], schema)("#")
+        assert reader.get("id").value() == record["id"]
+        assert reader.get("topic").value() == record["topic"]
+
+
+def test_fixed_width_slots():
+    import struct
+    from buffer_ql import extend_schema, create_reader
+
+    fixed = create_encoder(SCHEMA, fixed_width=True)(dummy_data, "#")
+    assert fixed[0] & 0x08 and (fixed[0] >> 4) in (1, 2, 4)
+    assert create_reader(fixed, SCHEMA)("#").value() == \
+        create_reader(encoded, SCHEMA)("#").value()
+
+    schema = extend_schema({}, {"#": "Array<Array<Int32>>"})
+    data = [list(range(i)) for i in range(5)]
+    container = create_encoder(schema, fixed_width=True)(data, "#")
+    Reader = create_reader(container, schema)
+    assert Reader("#").value() == data
+
+    # the (offset, length) slots of the inner arrays unpack in one call
+    n, m = Reader.index_size, Reader.length_size
+    start = Reader("#").get(0).current_offset
+    slots = list(struct.iter_unpack(
+        f"<{'bhi'[n // 2]}{'BHI'[m // 2]}", container[start:start + 5 * (n + m)]))
+    assert [length for _, length in slots] == [len(value) for value in data]
+
+
+def test_large_index_sizes():
+    from types import SimpleNamespace
+    from buffer_ql.core.writer import optimizeAlloc, tape_range
+
+    def alloc(index_size):
+        return SimpleNamespace(index_size=index_size, length_size=0,
+                               unit_size=1, max_length=1)
+
+    # ~5 GB and ~1 TB of slots no longer overflow the index
+    assert optimizeAlloc(alloc(1 << 30), set(), 0) == [5, 1]
+    assert optimizeAlloc(alloc(1 << 37), set(), 0) == [6, 1]
+    assert optimizeAlloc(alloc(1 << 30), set(), 0, True) == [8, 1]
+
+    # fixed width slots are sized for the tape pointers written in them,
+    # padded zigzag varints of 6, 13 and 27 bits
+    assert optimizeAlloc(alloc(62), set(), 0, True) == [1, 1]
+    assert optimizeAlloc(alloc(63), set(), 0, True) == [2, 1]
+    assert optimizeAlloc(alloc(4095), set(), 0, True) == [2, 1]
+    assert optimizeAlloc(alloc(4096), set(), 0, True) == [4, 1]
+    assert optimizeAlloc(alloc((1 << 25) - 1), set(), 0, True) == [4, 1]
+    assert optimizeAlloc(alloc(1 << 25), set(), 0, True) == [8, 1]
+
+    from buffer_ql import extend_schema, create_reader
+
+    schema = extend_schema({}, {"#": "Array<String>"})
+    names = [f"s{i:05d}" for i in range(1500)]
+    encoded = create_encoder(schema, fixed_width=True)(names, "#")
+    assert encoded[0] >> 4 == 4
+    assert create_reader(encoded, schema)("#").value() == names
+
+    # a planned layout is reused for exactly the tape sizes optimizeAlloc
+    # would plan it with again
+    for fixed_width in (False, True):
+        for index_size in (3, 40, 5000):
+            n, m = optimizeAlloc(alloc(index_size), {1, 3}, 100, fixed_width)
+            sizes = tape_range(alloc(index_size), {1, 3}, n, m, fixed_width)
+            for additional in {0, max(sizes.start - 1, 0), sizes.start, sizes.stop - 1, sizes.stop}:
+                planned = optimizeAlloc(alloc(index_size), {1, 3}, additional, fixed_width)
+                assert (planned == [n, m]) == (additional in sizes)
+
+
+def test_dedup_subtrees():
+    from buffer_ql import extend_schema, create_reader
+
+    deduped = create_encoder(SCHEMA, dedup=True)(dummy_data, "#")
+    assert len(deduped) <= len(encoded)
+    assert create_reader(deduped, SCHEMA)("#").value() == \
+        create_reader(encoded, SCHEMA)("#").value()
+
+    schema = extend_schema({}, {"#": "Array<Array<Pose>>",
+                                "Pose": {"x": "Float64", "y": "Optional<Float64>"}})
+    path = [{"x": float(i), "y": None if i % 2 else -0.0} for i in range(50)]
+    other = [{"x": float(i), "y": None if i % 2 else 0.0} for i in range(50)]
+    data = [path, other, list(path), path]
+    plain = create_encoder(schema)(data, "#")
+    shared = create_encoder(schema, dedup=True)(data, "#")
+    assert len(shared) < len(plain) - 2 * 50 * 8
+    values = create_reader(shared, schema)("#").value()
+    assert values == data
+    assert [str(pose["y"]) for pose in values[0][:2]] == ["-0.0", "None"]
+    assert str(values[1][0]["y"]) == "0.0"
+
+
+def test_packed_rows():
+    from buffer_ql import extend_schema, create_reader, ALL_VALUES
+
+    types = {
+        "#": "Array<Pose>",
+        "Pose": {"position": "Vector3", "heading": "Float64", "frame": "Uint8"},
+    }
+    data = [{"position": [i, i + 0.5, -i], "heading": i / 3, "frame": i}
+            for i in range(6)]
+    schema = extend_schema({}, types, annotations={"Pose": {"packed": True}})
+    packed = create_encoder(schema)(data, "#")
+    columns = extend_schema({}, types)
+
+    Reader = create_reader(packed, schema)
+    assert Reader("#").value() == create_reader(
+        create_encoder(columns)(data, "#"), columns)("#").value()
+    assert Reader("#").get(2).get("heading").value() == 2 / 3
+    assert Reader("#").get(ALL_VALUES).get("frame").value() == list(range(6))
+    # fields are laid out in key order: frame, heading, position
+    assert Reader("#").get(1).rows() == (1, 1 / 3, 1.0, 1.5, -1.0)
+    # 21 byte rows only need the Float64 field aligned, not the row size
+    offset = Reader("#").get(0).current_offset
+    assert schema["Pose"]["size"] == 21 and offset % 8 == 0 and offset < 21
+
+    with pytest.raises(TypeError):
+        extend_schema({}, {"#": {"name": "String"}}, annotations={"#": {"packed": True}})
+
+
+def test_streaming_ingest(tmp_path):
+    from buffer_ql import (
+        extend_schema, create_reader, iter_json_array, iter_ndjson, encode_chunks,
+        encode_stream)
+
+    array_path = tmp_path / "entities.json"
+    array_path.write_text(json.dumps(tracked_entities, indent=1))
+    with open(array_path, "rb") as fp:
+        assert list(iter_json_array(fp, buffer_size=7)) == tracked_entities
+    with open(array_path) as fp:
+        assert list(iter_json_array(fp)) == tracked_entities
+
+    # numbers cut at a chunk boundary
+    import io
+    for text, expected in [("[1.5, 2.25]", [1.5, 2.25]), ("[10e3, 4]", [10e3, 4]),
+                           ("[-1.5e-3,7]", [-1.5e-3, 7])]:
+        for buffer_size in range(1, len(text) + 1):
+            assert list(iter_json_array(io.StringIO(text), buffer_size)) == expected
+
+    # a large element is not read and parsed again for every chunk
+    class Counted(io.StringIO):
+        reads = 0
+
+        def read(self, size=-1):
+            Counted.reads += 1
+            return super().read(size)
+
+    large = [{"name": "x" * 20000}, 1]
+    assert list(iter_json_array(Counted(json.dumps(large)), buffer_size=16)) == large
+    assert Counted.reads < 20
+
+    ndjson_path = tmp_path / "entities.ndjson"
+    ndjson_path.write_text("\n".join(json.dumps(e) for e in tracked_entities))
+
+    schema = extend_schema({}, {"#": "Array<Entity>", "Entity": {"id": "Int32", "class": "Uint8"}})
+    encode = create_encoder(schema)
+    with open(ndjson_path) as fp:
+        containers = list(encode_chunks(encode, iter_ndjson(fp), "#", chunk_size=3))
+    assert len(containers) == -(-len(tracked_entities) // 3)
+    ids = [e["id"] for c in containers for e in create_reader(c, schema)("#").value()]
+    assert ids == [e["id"] for e in tracked_entities]
+
+    with open(array_path, "rb") as fp:
+        container = encode_stream(create_encoder(SCHEMA),
+                                  iter_json_array(fp, buffer_size=64), "#", "trackedEntities")
+    expected = {"trackedEntities": tracked_entities, "trackedEntitiesOfInterest": {}}
+    assert create_reader(container, SCHEMA)("#").value() == \
+        create_reader(create_encoder(SCHEMA)(expected, "#"), SCHEMA)("#").value()
+
+
+def test_aggregates():
+    from buffer_ql import create_reader, ALL_VALUES
+
+    entities = create_reader(encoded, SCHEMA)("#").get("trackedEntities").get(ALL_VALUES)
+    classes = [e["class"] for e in tracked_entities]
+    ids = [e["id"] for e in tracked_entities]
+    assert entities.get("class").aggregate("count") == len(classes)
+    assert entities.get("id").aggregate("sum") == sum(ids)
+    assert entities.get("id").aggregate("max") == max(ids)
+    assert entities.get("class").histogram([0, 2, 4, 256]) == [
+        sum(lo <= c < hi for c in classes) for lo, hi in [(0, 2), (2, 4), (4, 256)]]
+
+    expected = {}
+    for c, i in zip(classes, ids):
+        expected[c] = expected.get(c, 0) + i
+    assert entities.get("id").group_by(entities.get("class"), "sum") == expected
+
+    # per entity reductions over the nested, optional probabilities
+    probabilities = entities.get("waypoints").get(ALL_VALUES).get("probability")
+    for entity, count in zip(tracked_entities, probabilities.aggregate("count")):
+        expected = [w.get("probability") for w in entity.get("waypoints") or []]
+        assert count == sum(p is not None for p in expected)
+
+
+def scan_schema():
+    from buffer_ql import extend_schema
+    return extend_schema({}, {"#": "Array<Int32>"})
+
+
+def scan_sum(Reader):
+    return Reader("#").get(ALL_VALUES).aggregate("sum")
+
+
+def test_parallel_scan(tmp_path):
+    from operator import add
+    from buffer_ql import scan, store_items
+
+    encode = create_encoder(scan_schema())
+    paths = []
+    for k in range(4):
+        path = tmp_path / f"{k}.bin"
+        path.write_bytes(encode(list(range(k * 10)), "#"))
+        paths.append(str(path))
+    expected = [sum(range(k * 10)) for k in range(4)]
+    assert scan(paths, scan_schema, scan_sum, processes=0) == expected
+    assert scan(paths, scan_schema, scan_sum, add, processes=2) == sum(expected)
+
+    store = tmp_path / "store.bin"
+    buffer, offsets = encode.encode_many(
+        [list(range(k * 10)) for k in range(4)], "#", concat=True)
+    store.write_bytes(buffer)
+    assert scan(store_items(str(store), offsets), scan_schema, scan_sum,
+                add, 100, processes=2) == 100 + sum(expected)
+
+
+def test_traversal_cache():
+    from buffer_ql import create_reader
+
+    plain = create_reader(encoded, SCHEMA)("#").value()
+    Reader = create_reader(encoded, SCHEMA, cache_bytes=1 << 20)
+    assert Reader("#").value() == plain
+    first = Reader.traversal_cache.stats()
+    assert Reader("#").value() == plain
+    second = Reader.traversal_cache.stats()
+    assert second["hits"] > first["hits"] and second["misses"] == first["misses"]
+    assert 0 < second["bytes"] <= 1 << 20
+
+    Small = create_reader(encoded, SCHEMA, cache_bytes=2048)
+    assert Small("#").value() == plain
+    assert Small.traversal_cache.size_bytes <= 2048
+
+
+def test_iter_rows():
+    from buffer_ql import create_reader
+
+    Reader = create_reader(encoded, SCHEMA)
+    entities = Reader("#").get("trackedEntities")
+    expected = entities.value()
+    for batch_size in (1, 3, 1000):
+        assert list(entities.iter_rows(batch_size)) == expected
+
+    # each batch of a OneOf column decodes its own rows only, not the
+    # whole column again
+    from buffer_ql import extend_schema
+
+    schema = extend_schema({}, {"#": {"values": "Array<OneOf<String,Int32>>",
+                                      "rows": "Array<Row>"},
+                                "Row": {"id": "Int32", "src": "OneOf<String,Int32>"}})
+    data = {"values": [str(i) if i % 3 else i for i in range(600)],
+            "rows": [{"id": i, "src": str(i) if i % 2 else i} for i in range(600)]}
+    Reader = create_reader(create_encoder(schema)(data, "#"), schema)
+    decode = schema["Int32"]["decode"]
+    calls = [0]
+
+    def counted(*args):
+        calls[0] += 1
+        return decode(*args)
+    schema["Int32"]["decode"] = counted
+
+    for key, decoded in (("values", 200), ("rows", 900)):
+        calls[0] = 0
+        assert list(Reader("#").get(key).iter_rows(10)) == data[key]
+        assert calls[0] <= decoded
+
+
+def test_class_binding():
+    from dataclasses import dataclass
+    from typing import NamedTuple
+    from buffer_ql import extend_schema, create_reader
+
+    @dataclass(slots=True)
+    class Pose:
+        position: list
+        heading: float
+
+    class Sample(NamedTuple):
+        pose: Pose
+        tag: str
+
+    class Track:
+        __slots__ = ("id", "samples")
+
+        def __init__(self, id, samples):
+            self.id = id
+            self.samples = samples
+
+        def __eq__(self, other):
+            return (self.id, self.samples) == (other.id, other.samples)
+
+    schema = extend_schema(
+        {},
+        {
+            "#": "Array<Track>",
+            "Track": {"id": "Int32", "samples": "Array<Sample>"},
+            "Sample": {"pose": "Pose", "tag": "Optional<String>"},
+            "Pose": {"position": "Vector3", "heading": "Float64"},
+        },
+        annotations={"Track": {"bind": Track}, "Sample": {"bind": Sample},
+                     "Pose": {"bind": Pose}}
+    )
+    tracks = [
+        Track(i, [Sample(Pose([i, 0.5, 1.0], i / 4), None if k % 2 else f"t{k}")
+                  for k in range(i)])
+        for i in range(4)
+    ]
+    container = create_encoder(schema)(tracks, "#")
+    assert container == create_encoder(schema)([
+        {"id": t.id, "samples": [
+            {"pose": {"position": s.pose.position, "heading": s.pose.heading}, "tag": s.tag}
+            for s in t.samples]}
+        for t in tracks], "#")
+
+    reader = create_reader(container, schema)("#")
+    assert reader.value() == tracks
+    assert list(reader.iter_rows(2)) == tracks
+    assert isinstance(reader.get(2).get("samples").get(0).value(), Sample)
+
+    # values that are not records still fail instead of reading as all None
+    from buffer_ql import validate_data
+    unbound = extend_schema({}, {"#": {"pose": "Pose", "tag": "Optional<String>"},
+                                 "Pose": {"heading": "Optional<Float64>"}})
+    for pose in ["north", [0.5]]:
+        with pytest.raises((TypeError, AttributeError)):
+            create_encoder(unbound)({"pose": pose, "tag": None}, "#")
+        with pytest.raises(ValueError, match=r"#\.pose,"):
+            validate_data(unbound, {"pose": pose, "tag": None}, "#")
+
+
+def test_trusted_and_validate():
+    from buffer_ql import extend_schema, create_reader, validate_data
+
+    schema = extend_schema(
+        {},
+        {
+            "#": "Array<Item>",
+            "Item": {"id": "Uint16", "shape": "OneOf<Vector3,Vector4,String>",
+                     "tags": "Map<Optional<Int32>>"},
+        }
+    )
+    data = [
+        {"id": i, "shape": [0.5] * (3 + i % 2) if i % 3 else f"s{i}",
+         "tags": {"a": i, "b": None}}
+        for i in range(20)
+    ]
+    expected = create_encoder(schema)(data, "#")
+    assert create_encoder(schema, trusted=True)(data, "#") == expected
+    assert create_encoder(schema, validate=True)(data, "#") == expected
+    # a branch told apart by the contents of a value, not its type
+    lists = extend_schema(
+        {},
+        {"#": "Array<OneOf<Ints,Strs>>", "Ints": "Array<Int32>", "Strs": "Array<String>"},
+        checks={"Ints": lambda value: all(isinstance(v, int) for v in value),
+                "Strs": lambda value: all(isinstance(v, str) for v in value)}
+    )
+    values = [[1, 2], ["a", "b"]]
+    encoded = create_encoder(lists, trusted=True)(values, "#")
+    assert encoded == create_encoder(lists)(values, "#")
+    assert create_reader(encoded, lists)("#").value() == values
+    assert create_reader(expected, schema)("#").value() == data
+
+    validate_data(schema, data, "#")
+    bad = [dict(item) for item in data]
+    bad[7] = {**bad[7], "shape": [0.5, 1, 0.5]}
+    with pytest.raises(ValueError, match=r"#\[7\]\.shape"):
+        validate_data(schema, bad, "#")
+    bad[7] = data[7]
+    bad[4] = {**bad[4], "tags": {"a": 1 << 40}}
+    with pytest.raises(ValueError, match=r"#\[4\]\.tags\['a'\]"):
+        create_encoder(schema, validate=True)(bad, "#")
+    bad[2] = {**bad[2], "id": -1}
+    with pytest.raises(ValueError, match=r"#\[2\]\.id"):
+        validate_data(schema, bad, "#")
+
+    floats = extend_schema({}, {"#": "Array<Float32>"})
+    with pytest.raises(ValueError, match=r"#\[1\]"):
+        create_encoder(floats, validate=True)([0.5, 1e300], "#")
+
+
+def test_inspect_container(tmp_path, capsys):
+    from buffer_ql import extend_schema, inspect_container
+    from buffer_ql.__main__ import main
+
+    report = inspect_container(encoded, SCHEMA)
+    assert report.header == (encoded[0] >> 4, encoded[0] & 7)
+    assert sum(entry.total for entry in report.paths.values()) <= len(encoded)
+    assert report.paths["TrackedEntity.id"].payload == 4 * len(tracked_entities)
+    assert 0 < report.paths["TrackedEntity.velocity"].density[0] < 1
+    assert report.paths["String"].dedup_ratio > 1
+    assert ("TrackedEntity.id", "values fit in Uint8", 3 * len(tracked_entities)) \
+        in report.suggestions
+
+    path = tmp_path / "container.bin"
+    path.write_bytes(encoded)
+    assert main(["inspect", str(path), "test.test_schema:SCHEMA"]) == 0
+    out = capsys.readouterr().out
+    assert "header (n, m)" in out and "TrackedEntity.id: values fit in Uint8" in out
+
+    # vector arrays, compressed columns, hash key tables and sections
+    schema = extend_schema(
+        {},
+        {"#": {"points": "Vector3Array", "poses": "Matrix4Array", "rows": "Array<Row>",
+               "lookup": "Map<Int32>"},
+         "Row": {"id": "Int32", "score": "Float64"}},
+        annotations={"Row.id": {"compression": "zlib"}, "Row.score": {"stats": 10},
+                     "#.lookup": {"key_index": "hash"}}
+    )
+    data = {"points": [0.5] * 12, "poses": [1.0] * 32, "lookup": {"a": 1, "b": 2},
+            "rows": [{"id": i, "score": i / 2} for i in range(100)]}
+    container = create_encoder(schema)(data, "#")
+    report = inspect_container(container, schema)
+    assert report.paths["Vector3"].payload == 4 * 12
+    assert report.paths["Matrix4"].payload == 4 * 32
+    assert report.paths["Row.id"].payload == 0 and report.paths["Row.id"].tape > 0
+    assert report.paths["Row.score"].payload == 8 * 100 and report.paths["Row.score"].tape > 0
+    assert report.paths["#.lookup"].tape > 0
+    assert report.paths["String"].values == 2
+    assert ("Row.score", "values are exact in Float32", 4 * 100) in report.suggestions
+    assert ("Row.id", "values fit in Uint8", 3 * 100) in report.suggestions
+    assert sum(entry.total for entry in report.paths.values()) <= len(container)
+
+
+def test_append_builder():
+    from buffer_ql import create_reader
+
+    encode = create_encoder(SCHEMA)
+    builder = encode.builder("#")
+    for entity in tracked_entities:
+        builder.append("trackedEntities", entity)
+        with pytest.raises(OverflowError):
+            builder.append(["trackedEntities"], {**entity, "class": 256})
+    with pytest.raises(ValueError):
+        builder.set("trackedEntities", [])
+    with pytest.raises(TypeError):
+        builder.append("trackedEntitiesOfInterest", {})
+
+    container = builder.finish()
+    expected = {"trackedEntities": tracked_entities, "trackedEntitiesOfInterest": {}}
+    reader = create_reader(container, SCHEMA)("#")
+    assert reader.value() == create_reader(encode(expected, "#"), SCHEMA)("#").value()
+    with pytest.raises(ValueError):
+        builder.append("trackedEntities", tracked_entities[0])
+
+    from buffer_ql import extend_schema
+    floats = extend_schema({}, {"#": {"f": "Array<Float32>", "v": "Array<Vector3Array>"}})
+    builder = create_encoder(floats).builder("#")
+    for path, record in [("f", 1e300), ("v", [0.5, 1e300, 0.5])]:
+        with pytest.raises(OverflowError):
+            create_encoder(floats)({"f": [], "v": [], path: [record]}, "#")
+        with pytest.raises(OverflowError):
+            builder.append(path, record)
+
+
+def test_sections_trailer():
+    from buffer_ql import extend_schema, create_reader
+
+    # a value ending in the magic bytes is not taken for a trailer
+    schema = extend_schema({}, {"#": {"a": "Int32", "name": "String"}})
+    value = {"a": 1, "name": "xxxxxxxxBQLS"}
+    container = create_encoder(schema)(value, "#")
+    reader = create_reader(container, schema)
+    assert not reader.sections and reader("#").value() == value
+
+    annotated = extend_schema({}, {"#": {"a": "Int32", "name": "String"}},
+                              annotations={"#.a": {"indexed": True}})
+    container = create_encoder(annotated)(value, "#")
+    reader = create_reader(container, annotated)
+    assert reader.sections and reader("#").value() == value
+    # the header is a regular one, readers without sections support
+    # (here one without the annotation) read the container as is
+    assert container[0] >> 4 >= 1
+    assert create_reader(container, schema)("#").value() == value
+
+    corrupted = bytearray(container)
+    corrupted[-5] ^= 1
+    assert not create_reader(bytes(corrupted), annotated).sections
@@ -1,3 +1,5 @@
+from array import array
+
 from buffer_ql.helpers.bitmask import (
     encode_bitmask,
     decode_bitmask,
@@ -18,6 +20,7 @@ from buffer_ql.helpers.bitmask import (
     forward_map_single_one_of,
     backward_map_single_one_of,
     diff_indexes,
+    Memoized,
 )
 
 def test_bitmask():
@@ -79,3 +82,42 @@ def test_bitmask():
     
 
 test_bitmask()
+
+
+def test_memoized_indexes():
+    calls = []
+
+    def generate():
+        for i in range(5):
+            calls.append(i)
+            yield i
+
+    indexes = Memoized(generate)
+    assert next(iter(indexes)) == 0
+    assert list(indexes) == [0, 1, 2, 3, 4]
+    assert list(indexes) == [0, 1, 2, 3, 4]
+    assert len(indexes) == 5 and list(indexes[1:3]) == [1, 2]
+    assert calls == [0, 1, 2, 3, 4]
+
+    one_of_index = one_of_to_index([0, 1, 1, 0, 2], 3)
+    backward = backward_map_one_of(one_of_index, 3)
+    assert [list(b) for b in backward] == [[0, 3], [1, 2], [4]]
+    assert list(one_of_index) == list(one_of_to_index([0, 1, 1, 0, 2], 3))
+
+
+def test_chained_indexes_compose_arrays():
+    decoded = decode_bitmask(encode_bitmask(bit_to_index([0, 1, 1, 0, 1, 1, 1, 0]), 7), 7)
+    forward = forward_map_indexes(decoded)
+    backward = backward_map_indexes(decoded)
+
+    chained_forward = chain_forward_indexes(forward, forward)
+    chained_backward = chain_backward_indexes(backward, backward)
+    assert isinstance(chained_forward.materialize(), array)
+    assert list(chained_forward) == [
+        -1 if i < 0 or i >= len(forward) else forward[i] for i in forward
+    ]
+    assert list(chained_backward) == [backward[i] for i in backward if i < len(backward)]
+
+    deeper = chain_forward_indexes(chained_forward, forward)
+    assert list(deeper) == [-1, -1, -1, -1, 0, -1, 1]
+    assert list(chain_backward_indexes(chained_backward, backward)) == [4, 6]